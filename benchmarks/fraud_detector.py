@@ -0,0 +1,74 @@
+"""
+Замер пропускной способности FraudDetector (транзакций в секунду) на синтетических данных без обращения к БД.
+
+Запуск из корня репозитория: python -m benchmarks.fraud_detector [--transactions N] [--batch-size N]
+"""
+import argparse
+import dataclasses
+import datetime
+import random
+import time
+
+from py_scripts.dimension_cache import CardOwner, build_card_owners, build_terminal_cities
+from py_scripts.fraud_detector import FraudDetector
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара', 'Омск', 'Пермь']
+
+
+def generate_data(transactions_count, clients_count, terminals_count, report_date, seed=0):
+    rnd = random.Random(seed)
+    card_owners = {
+        f'{i:016d} ': CardOwner(
+            client_id=f'{i:010d}',
+            passport_num=f'{i:010d}',
+            fio='Иванов Иван Иванович',
+            phone='+7-900-000-00-00',
+            passport_valid_to=report_date + datetime.timedelta(days=rnd.randint(-30, 3000)),
+            account_valid_to=report_date + datetime.timedelta(days=rnd.randint(-30, 3000)),
+        )
+        for i in range(clients_count)
+    }
+    terminal_cities = {f'T{i:05d}': rnd.choice(CITIES) for i in range(terminals_count)}
+    blacklisted_passports = {owner.passport_num for owner in card_owners.values() if rnd.random() < 0.01}
+
+    cards = list(card_owners)
+    terminals = list(terminal_cities)
+    start = datetime.datetime.combine(report_date, datetime.time())
+    step = 86400 / transactions_count
+    transactions = [
+        (str(i), start + datetime.timedelta(seconds=i * step), rnd.choice(cards), rnd.choice(terminals))
+        for i in range(transactions_count)
+    ]
+    return card_owners, terminal_cities, blacklisted_passports, transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.fraud_detector')
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--clients', type=int, default=50_000)
+    parser.add_argument('--terminals', type=int, default=5_000)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    report_date = datetime.date(2021, 3, 1)
+    card_owners, terminal_cities, blacklisted_passports, transactions = generate_data(
+        args.transactions, args.clients, args.terminals, report_date)
+    # владельцы карт и города терминалов передаются в том же виде, в котором они хранятся в кэше измерений
+    fraud_detector = FraudDetector(
+        build_card_owners([(card_num, *dataclasses.astuple(owner)) for card_num, owner in card_owners.items()]),
+        build_terminal_cities(terminal_cities.items()),
+        frozenset(blacklisted_passports),
+    )
+
+    events_count = 0
+    started = time.perf_counter()
+    for i in range(0, len(transactions), args.batch_size):
+        events_count += len(fraud_detector.score_transactions(transactions[i:i + args.batch_size], report_date))
+    elapsed = time.perf_counter() - started
+
+    print(f'transactions: {len(transactions)}, batch size: {args.batch_size}, events: {events_count}')
+    print(f'elapsed: {elapsed:.3f} s, throughput: {len(transactions) / elapsed:,.0f} transactions/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Замер времени импорта точек входа (main.py, модуля с этапами загрузки и модуля с DAG) с помощью
+python -X importtime. Для каждой точки входа выводится общее время импорта, самые медленные модули верхнего уровня и
+признак того, были ли импортированы тяжелые зависимости (pandas, numpy, openpyxl).
+
+Запуск из корня репозитория: python -m benchmarks.import_time [--repeat N] [--top N] [main] [etl_tasks] [dag]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+TARGETS = {
+    'main': 'import main',
+    'etl_tasks': 'import py_scripts.etl_tasks',
+    'dag': "import runpy; runpy.run_path('py_scripts/etl-dag.py')",
+}
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl']
+
+
+def measure_import_time(code):
+    """
+    Выполняет code в отдельном процессе с -X importtime и возвращает словарь
+    {модуль верхнего уровня: суммарное время импорта в мкс} и множество всех импортированных модулей
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    top_level_times = {}
+    imported_modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported_modules.add(name.strip())
+        # вложенные импорты выводятся с отступом, модули верхнего уровня - с одним пробелом
+        if not name.startswith('  '):
+            top_level_times[name.strip()] = int(cumulative)
+    return top_level_times, imported_modules
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.import_time')
+    parser.add_argument('targets', nargs='*', metavar='target', help=f'одна или несколько из: {", ".join(TARGETS)}')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    unknown_targets = set(args.targets) - set(TARGETS)
+    if unknown_targets:
+        parser.error(f'unknown targets: {", ".join(sorted(unknown_targets))}')
+
+    for target in args.targets or TARGETS:
+        try:
+            runs = [measure_import_time(TARGETS[target]) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f'{target}: import failed: {e}\n')
+            continue
+
+        totals = [sum(times.values()) for times, _ in runs]
+        top_level_times, imported_modules = runs[totals.index(statistics.median_low(totals))]
+        heavy_modules = [x for x in HEAVY_MODULES if x in imported_modules]
+
+        print(f'{target}: median total import time {statistics.median(totals) / 1000:.1f} ms '
+              f'(min {min(totals) / 1000:.1f} ms, {args.repeat} runs)')
+        print(f'  heavy modules imported: {", ".join(heavy_modules) or "none"}')
+        for name, cumulative in sorted(top_level_times.items(), key=lambda x: -x[1])[:args.top]:
+            print(f'  {cumulative / 1000:8.1f} ms  {name}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
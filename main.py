@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 import psycopg2
 
+from py_scripts.common_helpers import purge_processed_folder
 from py_scripts.settings import Settings
 
 from py_scripts.etl_tasks import load_data_into_dwh
 from py_scripts.report_generators import generate_reports
 
-settings = Settings()
 
-
-def get_db_connection():
+def get_db_connection(settings: Settings):
     return psycopg2.connect(
         dbname=settings.dbname,
         user=settings.user,
@@ -20,13 +19,27 @@ def get_db_connection():
 
 
 def main():
+    settings = Settings()
+
+    if settings.watch:
+        # модуль режима непрерывной загрузки (и asyncio) импортируется только при запуске в этом режиме
+        from py_scripts.watcher import watch_landing_folder
+
+        watch_landing_folder(settings.landing_folder, settings.poll_interval, settings.queue_size,
+                             lambda: get_db_connection(settings), settings.micro_batch_size,
+                             settings.archive_retention_days, settings.dim_load_mode)
+        return
+
     for current_date in settings.processing_dates:
-        with get_db_connection() as connection:
-            with connection.cursor() as cursor:
-                load_data_into_dwh(current_date, cursor)
-                connection.commit()
+        with get_db_connection(settings) as connection:
+            # каждый этап загрузки и каждый отчет фиксируются отдельно, поэтому при повторном запуске после сбоя
+            # обработка продолжается с этапа, на котором произошла ошибка
+            load_data_into_dwh(current_date, connection, settings.landing_folder, settings.dim_load_mode)
+            generate_reports(current_date, connection, settings.dim_load_mode)
+
+    if settings.archive_retention_days is not None:
+        purge_processed_folder(settings.archive_retention_days)
 
-                generate_reports(current_date, cursor)
-                connection.commit()
 
-main()
+if __name__ == '__main__':
+    main()
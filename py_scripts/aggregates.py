@@ -0,0 +1,137 @@
+CLIENT_DAILY_FEATURES_TABLE_FULL_NAME = 'public.sevl_dwh_agg_client_daily'
+
+
+def update_client_daily_features(staging_table_full_name: str, cursor) -> None:
+    """
+    Обновляет агрегированные за день признаки клиентов для всех пар (клиент, день), к которым относятся транзакции
+    из стейдж-таблицы. Признаки для затронутых пар пересчитываются целиком по таблице фактов, поэтому повторная
+    загрузка тех же транзакций не искажает значения, а остальные строки агрегата не затрагиваются.
+
+    Признак max_cities_per_hour вычисляется по тому же скользящему окну в один час, что и отчет об операциях в разных
+    городах: для каждой операции дня считается количество разных городов среди операций клиента за предшествующий час
+    (включая последний час предыдущего дня), и берется максимум.
+
+    Признак срока действия счета соответствует данным, загруженным в DWH на момент загрузки транзакций. Признаки
+    паспорта при последующей загрузке клиентов и черного списка обновляет update_client_passport_features.
+    :param staging_table_full_name: полное имя стейдж-таблицы с транзакциями, включая имя схемы
+    :param cursor: курсор к БД
+    """
+    query = f"""
+        with affected_client_days as
+                 (select distinct acc.client as client_id, stg.trans_date::date as trans_dt
+                  from {staging_table_full_name} stg
+                  join public.sevl_dwh_dim_cards crd
+                      on crd.card_num = stg.card_num
+                  join public.sevl_dwh_dim_accounts acc
+                      on acc.account_num = crd.account_num),
+
+             window_transactions as
+                 (select af.client_id,
+                         af.trans_dt,
+                         tr.trans_date,
+                         tr.amt,
+                         trm.terminal_city,
+                         acc.valid_to as account_valid_to
+                  from affected_client_days af
+                  join public.sevl_dwh_dim_accounts acc
+                      on acc.client = af.client_id
+                  join public.sevl_dwh_dim_cards crd
+                      on crd.account_num = acc.account_num
+                  join public.sevl_dwh_fact_transactions tr
+                      on tr.card_num = crd.card_num
+                      and tr.trans_date >= af.trans_dt - interval '1' hour
+                      and tr.trans_date < af.trans_dt + interval '1' day
+                  join public.sevl_dwh_dim_terminals trm
+                      on trm.terminal_id = tr.terminal),
+
+             -- операции самого дня; операции последнего часа предыдущего дня нужны только для скользящего окна
+             client_transactions as
+                 (select *
+                  from window_transactions
+                  where trans_date >= trans_dt),
+
+             last_hour_cities as
+                 (select client_id,
+                         trans_dt,
+                         trans_date,
+                         array_agg(terminal_city) over (
+                             partition by client_id, trans_dt
+                             order by trans_date
+                             range between interval '1' hour preceding and current row
+                             ) as cities_last_hour
+                  from window_transactions),
+
+             last_hour_city_counts as
+                 (select lhc.client_id,
+                         lhc.trans_dt,
+                         (select count(distinct city) from unnest(lhc.cities_last_hour) as city) as city_count
+                  from last_hour_cities lhc
+                  where lhc.trans_date >= lhc.trans_dt),
+
+             hourly_cities as
+                 (select client_id, trans_dt, max(city_count) as city_count
+                  from last_hour_city_counts
+                  group by client_id, trans_dt)
+
+        insert into {CLIENT_DAILY_FEATURES_TABLE_FULL_NAME}(
+            client_id, trans_dt, trans_count, total_amt, city_count, max_cities_per_hour,
+            min_account_valid_to, passport_valid_to, is_passport_blacklisted, update_dt)
+        select
+            ct.client_id,
+            ct.trans_dt,
+            count(*),
+            sum(ct.amt),
+            count(distinct ct.terminal_city),
+            (select hc.city_count
+             from hourly_cities hc
+             where hc.client_id = ct.client_id and hc.trans_dt = ct.trans_dt),
+            min(ct.account_valid_to),
+            cl.passport_valid_to,
+            exists(select 1
+                   from public.sevl_dwh_fact_passport_blacklist blk
+                   where blk.passport_num = cl.passport_num),
+            localtimestamp(0)
+        from client_transactions ct
+        join public.sevl_dwh_dim_clients cl
+            on cl.client_id = ct.client_id
+        group by ct.client_id, ct.trans_dt, cl.passport_valid_to, cl.passport_num
+        on conflict (client_id, trans_dt) do update set
+            trans_count = excluded.trans_count,
+            total_amt = excluded.total_amt,
+            city_count = excluded.city_count,
+            max_cities_per_hour = excluded.max_cities_per_hour,
+            min_account_valid_to = excluded.min_account_valid_to,
+            passport_valid_to = excluded.passport_valid_to,
+            is_passport_blacklisted = excluded.is_passport_blacklisted,
+            update_dt = excluded.update_dt;
+    """
+    cursor.execute(query)
+
+
+def update_client_passport_features(staging_table_full_name: str, key_column: str, cursor) -> None:
+    """
+    Пересчитывает признаки срока действия паспорта и наличия паспорта в черном списке во всех строках агрегата для
+    клиентов, данные которых затронуты стейдж-таблицей. Признаки вычисляются при загрузке транзакций, поэтому без
+    пересчета паспорт, загруженный в черный список или измененный позже транзакций, не отражался бы в агрегате.
+    :param staging_table_full_name: полное имя стейдж-таблицы с клиентами или с черным списком паспортов, включая
+    имя схемы
+    :param key_column: столбец стейдж-таблицы, по которому определяются затронутые клиенты (client_id или
+    passport_num); столбец с тем же именем должен быть в таблице клиентов
+    :param cursor: курсор к БД
+    """
+    query = f"""
+        update {CLIENT_DAILY_FEATURES_TABLE_FULL_NAME} agg
+        set passport_valid_to = cl.passport_valid_to,
+            is_passport_blacklisted = exists(select 1
+                                             from public.sevl_dwh_fact_passport_blacklist blk
+                                             where blk.passport_num = cl.passport_num),
+            update_dt = localtimestamp(0)
+        from public.sevl_dwh_dim_clients cl
+        where cl.client_id = agg.client_id
+            and cl.{key_column} in (select stg.{key_column} from {staging_table_full_name} stg)
+            and (agg.passport_valid_to is distinct from cl.passport_valid_to
+                 or agg.is_passport_blacklisted <> exists(select 1
+                                                          from public.sevl_dwh_fact_passport_blacklist blk
+                                                          where blk.passport_num = cl.passport_num));
+    """
+    cursor.execute(query)
@@ -1,10 +1,29 @@
 import datetime
+import gzip
 import os
 import shutil
+import time
+from typing import BinaryIO
 
 STRING_DATE_REPR_FORMAT = '%d%m%Y'
 PROCESSED_FILE_FOLDER = 'archive'
-PROCESSED_FILE_EXTENSION = '.backup'
+PROCESSED_FILE_EXTENSION = '.gz'
+PROCESSED_FILE_COMPRESS_LEVEL = 6
+QUARANTINE_FILE_FOLDER = 'quarantine'
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# режимы загрузки измерений: scd1 - только перезапись строк в таблицах измерений, scd2 - дополнительно ведется история
+# версий строк в таблицах с суффиксом HISTORY_TABLE_SUFFIX, в которых каждая версия действует в интервале
+# [EFFECTIVE_FROM_FIELD_NAME, EFFECTIVE_TO_FIELD_NAME), а у текущей версии EFFECTIVE_TO_FIELD_NAME = MAX_EFFECTIVE_TO;
+# строки, загруженные до включения режима scd2, получают версии, действующие с MIN_EFFECTIVE_FROM
+DIM_LOAD_MODE_SCD1 = 'scd1'
+DIM_LOAD_MODE_SCD2 = 'scd2'
+DIM_LOAD_MODES = [DIM_LOAD_MODE_SCD1, DIM_LOAD_MODE_SCD2]
+HISTORY_TABLE_SUFFIX = '_hist'
+EFFECTIVE_FROM_FIELD_NAME = 'effective_from'
+EFFECTIVE_TO_FIELD_NAME = 'effective_to'
+MIN_EFFECTIVE_FROM = '1800-01-01'
+MAX_EFFECTIVE_TO = '9999-12-31'
 
 
 def datetime_to_string_repr(dt: datetime.datetime) -> str:
@@ -15,6 +34,13 @@ def datetime_to_string_repr(dt: datetime.datetime) -> str:
     return dt.strftime(STRING_DATE_REPR_FORMAT)
 
 
+def history_table_name(table_full_name: str) -> str:
+    """
+    Возвращает полное имя таблицы с историей версий строк измерения table_full_name
+    """
+    return table_full_name + HISTORY_TABLE_SUFFIX
+
+
 def sql_column_list(columns: list[str], prefix: str = '') -> str:
     """
     Возвращает строку, содержащую перечисление столбцов из columns с префиксом prefix в формате SQL
@@ -29,10 +55,81 @@ def sql_value_placeholders(columns: list[str]) -> str:
     return ', '.join(['%s'] * len(columns))
 
 
-def move_file_to_processed_folder(filename: str) -> None:
+def archived_file_path(filename: str, current_date: datetime.datetime) -> str:
+    """
+    Возвращает путь к сжатой копии файла filename в архиве: файлы хранятся в папке archive в подкаталогах вида
+    YYYY/MM/DD по дате, за которую они были загружены, и имеют расширение, заданное в PROCESSED_FILE_EXTENSION
+    """
+    return os.path.join(_archive_partition_folder(current_date), os.path.basename(filename) + PROCESSED_FILE_EXTENSION)
+
+
+def move_file_to_processed_folder(filename: str, current_date: datetime.datetime) -> None:
+    """
+    Перемещает файл filename (который может находиться в любом каталоге) в архив, сжимая его (см. archived_file_path).
+    Сжатие выполняется потоково, без загрузки файла в память, а исходный файл удаляется только после того, как сжатая
+    копия полностью записана
+    """
+    processed_filename = archived_file_path(filename, current_date)
+    os.makedirs(os.path.dirname(processed_filename), exist_ok=True)
+
+    tmp_filename = processed_filename + '.tmp'
+    with open(filename, 'rb') as src, gzip.open(tmp_filename, 'wb', compresslevel=PROCESSED_FILE_COMPRESS_LEVEL) as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_filename, processed_filename)
+    os.remove(filename)
+
+
+def move_file_to_quarantine_folder(filename: str) -> str:
+    """
+    Перемещает файл filename, который не был загружен, в папку QUARANTINE_FILE_FOLDER для разбора вручную
+    :return: новый путь к файлу
     """
-    Перемещает файл filename в папку archive, добавляя к нему расширение, заданное в PROCESSED_FILE_EXTENSION
+    os.makedirs(QUARANTINE_FILE_FOLDER, exist_ok=True)
+    quarantined_filename = os.path.join(QUARANTINE_FILE_FOLDER, os.path.basename(filename))
+    shutil.move(filename, quarantined_filename)
+    return quarantined_filename
+
+
+def open_archived_file(filename: str, current_date: datetime.datetime) -> BinaryIO:
     """
-    processed_filename = os.path.join(PROCESSED_FILE_FOLDER, filename + PROCESSED_FILE_EXTENSION)
-    # shutil.copy(filename, processed_filename)
-    shutil.move(filename, processed_filename)
+    Открывает для чтения сжатую копию файла filename из архива; данные распаковываются потоково по мере чтения
+    """
+    return gzip.open(archived_file_path(filename, current_date), 'rb')
+
+
+def purge_processed_folder(retention_days: int, now: float | None = None) -> None:
+    """
+    Удаляет из архива файлы, перенесенные в архив более retention_days дней назад, и оставшиеся пустыми подкаталоги.
+    Срок хранения отсчитывается от даты архивации (даты изменения сжатой копии), а не от даты, за которую файл был
+    загружен, поэтому файлы, загруженные за прошлые даты (например, при загрузке за несколько дат), не удаляются сразу
+    после архивации
+    :param retention_days: срок хранения файлов в архиве в днях
+    :param now: текущее время (timestamp); по умолчанию - time.time()
+    """
+    min_archived_timestamp = (now if now is not None else time.time()) - retention_days * SECONDS_PER_DAY
+    for year in _numeric_subfolders(PROCESSED_FILE_FOLDER):
+        year_folder = os.path.join(PROCESSED_FILE_FOLDER, year)
+        for month in _numeric_subfolders(year_folder):
+            month_folder = os.path.join(year_folder, month)
+            for day in _numeric_subfolders(month_folder):
+                day_folder = os.path.join(month_folder, day)
+                for entry in os.scandir(day_folder):
+                    if entry.is_file() and entry.stat().st_mtime < min_archived_timestamp:
+                        os.remove(entry.path)
+                if not os.listdir(day_folder):
+                    os.rmdir(day_folder)
+            if not os.listdir(month_folder):
+                os.rmdir(month_folder)
+        if not os.listdir(year_folder):
+            os.rmdir(year_folder)
+
+
+def _archive_partition_folder(current_date: datetime.datetime) -> str:
+    return os.path.join(PROCESSED_FILE_FOLDER, current_date.strftime('%Y'), current_date.strftime('%m'),
+                        current_date.strftime('%d'))
+
+
+def _numeric_subfolders(folder: str) -> list[str]:
+    if not os.path.isdir(folder):
+        return []
+    return sorted(x.name for x in os.scandir(folder) if x.is_dir() and x.name.isdigit())
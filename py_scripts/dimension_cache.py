@@ -0,0 +1,121 @@
+import datetime
+import sys
+import threading
+from dataclasses import dataclass
+
+from py_scripts.logger import logger
+from py_scripts.meta_info import METADATA_TABLE_FULL_NAME, deleted_rows_checkpoint_name
+
+# для каждой части кэша - контрольные точки в sevl_meta_info, по изменению которых определяется, что данные в DWH
+# изменились и часть кэша нужно загрузить заново: даты последнего обновления стейдж-таблиц (новые и измененные строки)
+# и даты последнего удаления строк из измерений
+CACHE_PART_CHECKPOINTS = {
+    'card_owners': ['public.sevl_stg_clients', 'public.sevl_stg_accounts', 'public.sevl_stg_cards',
+                    deleted_rows_checkpoint_name('public.sevl_dwh_dim_clients'),
+                    deleted_rows_checkpoint_name('public.sevl_dwh_dim_accounts'),
+                    deleted_rows_checkpoint_name('public.sevl_dwh_dim_cards')],
+    'terminal_cities': ['public.sevl_stg_terminals',
+                        deleted_rows_checkpoint_name('public.sevl_dwh_dim_terminals')],
+    'blacklisted_passports': ['public.sevl_stg_passport_blacklist'],
+}
+
+
+@dataclass(slots=True)
+class CardOwner:
+    client_id: str
+    passport_num: str
+    fio: str
+    phone: str
+    passport_valid_to: datetime.date | None
+    account_valid_to: datetime.date
+
+
+def build_card_owners(rows: list[tuple]) -> dict[str, CardOwner]:
+    """
+    Возвращает отображение номера карты в атрибуты владельца (CardOwner). Объект CardOwner создается по одному разу
+    для каждого клиента и срока действия счета и используется всеми картами с этими клиентом и сроком
+    :param rows: строки (card_num, client_id, passport_num, fio, phone, passport_valid_to, account_valid_to)
+    """
+    card_owners = {}
+    owners = {}
+    for card_num, client_id, passport_num, fio, phone, passport_valid_to, account_valid_to in rows:
+        owner = owners.get((client_id, account_valid_to))
+        if owner is None:
+            owner = owners[(client_id, account_valid_to)] = CardOwner(
+                client_id, passport_num, fio, phone, passport_valid_to, account_valid_to)
+        card_owners[card_num] = owner
+    return card_owners
+
+
+def build_terminal_cities(rows: list[tuple]) -> dict[str, str]:
+    """
+    Возвращает отображение идентификатора терминала в город; названия городов интернируются, поэтому каждое из них
+    хранится один раз
+    :param rows: строки (terminal_id, terminal_city)
+    """
+    return {terminal_id: sys.intern(city) for terminal_id, city in rows}
+
+
+class DimensionCache:
+    """
+    Кэш данных измерений DWH, общий для всего процесса. Каждая часть кэша загружается заново при вызове refresh,
+    если с момента ее загрузки в sevl_meta_info изменилась хотя бы одна из соответствующих ей контрольных точек
+    (см. CACHE_PART_CHECKPOINTS), в том числе при удалении строк из измерений.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.card_owners = {}
+        self.terminal_cities = {}
+        self.blacklisted_passports = frozenset()
+
+    def refresh(self, cursor) -> 'DimensionCache':
+        """
+        Загружает заново устаревшие части кэша
+        :param cursor: курсор к БД
+        :return: сам кэш
+        """
+        with self._lock:
+            cursor.execute(f"select table_name, max_update_dt from {METADATA_TABLE_FULL_NAME} "
+                           f"where table_name = any(%s)",
+                           ([x for checkpoints in CACHE_PART_CHECKPOINTS.values() for x in checkpoints],))
+            max_update_timestamps = dict(cursor.fetchall())
+
+            for part_name, checkpoints in CACHE_PART_CHECKPOINTS.items():
+                version = tuple(max_update_timestamps.get(x) for x in checkpoints)
+                if self._versions.get(part_name) == version:
+                    continue
+                logger.info(f'Загрузка части {part_name} кэша измерений')
+                getattr(self, f'_load_{part_name}')(cursor)
+                self._versions[part_name] = version
+        return self
+
+    def _load_card_owners(self, cursor):
+        cursor.execute("""
+            select
+                crd.card_num,
+                cl.client_id,
+                cl.passport_num,
+                cl.last_name || ' ' || cl.first_name || ' ' || cl.patronymic,
+                cl.phone,
+                cl.passport_valid_to,
+                acc.valid_to
+            from public.sevl_dwh_dim_cards crd
+            join public.sevl_dwh_dim_accounts acc
+                on acc.account_num = crd.account_num
+            join public.sevl_dwh_dim_clients cl
+                on cl.client_id = acc.client
+        """)
+        self.card_owners = build_card_owners(cursor.fetchall())
+
+    def _load_terminal_cities(self, cursor):
+        cursor.execute("select terminal_id, terminal_city from public.sevl_dwh_dim_terminals")
+        self.terminal_cities = build_terminal_cities(cursor.fetchall())
+
+    def _load_blacklisted_passports(self, cursor):
+        cursor.execute("select passport_num from public.sevl_dwh_fact_passport_blacklist")
+        self.blacklisted_passports = frozenset(r[0] for r in cursor.fetchall())
+
+
+dimension_cache = DimensionCache()
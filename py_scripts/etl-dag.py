@@ -1,18 +1,35 @@
-import psycopg2
-
-from py_scripts.etl_tasks import load_data_into_dwh as op_load_data_into_dwh
+from py_scripts.common_helpers import DIM_LOAD_MODE_SCD1
+from py_scripts.etl_tasks import (
+    LOAD_STAGES,
+    load_data_into_dwh as op_load_data_into_dwh,
+    run_load_stage as op_run_load_stage
+)
 from py_scripts.logger import logger
-from py_scripts.report_generators import generate_reports as op_generate_reports
+from py_scripts.report_generators import REPORTS, run_report as op_run_report
 
 from datetime import timedelta, datetime
 from typing import NoReturn
 
-from airflow.models import DAG, Variable
+from airflow.models import DAG, Param, Variable
 from airflow.operators.python import PythonOperator
 from airflow.utils.dates import days_ago
 
+PROCESSING_DATE_FORMAT = '%Y%m%d'
+
+default_args = {
+    'owner': 'Sergey Vershinin',
+    'email': 'sevlvershinin@edu.hse.ru',
+    'email_on_failure': True,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=1)
+}
+
 
 def get_db_connection():
+    # psycopg2 нужен только при выполнении задач, а не при разборе DAG планировщиком
+    import psycopg2
+
     return psycopg2.connect(
         host=Variable.get('HOST'),
         port=Variable.get('PORT'),
@@ -22,51 +39,116 @@ def get_db_connection():
     )
 
 
-def init() -> NoReturn:
-    logger.info('init start')
-    current_date = datetime.now(),
-    logger.ingo('initialized with current date %s', current_date)
-    return current_date
+def get_dim_load_mode() -> str:
+    return Variable.get('DIM_LOAD_MODE', default_var=DIM_LOAD_MODE_SCD1)
+
+
+def get_processing_date(data_interval_end) -> datetime:
+    """
+    Возвращает дату обработки для запуска DAG. Запуск по расписанию выполняется в конце интервала данных, поэтому
+    датой обработки считается конец интервала (в том же виде, в котором ее раньше возвращал datetime.now())
+    """
+    return datetime(data_interval_end.year, data_interval_end.month, data_interval_end.day,
+                    data_interval_end.hour, data_interval_end.minute, data_interval_end.second)
 
-def load_data_to_dwh() -> NoReturn:
+
+def load_stage(stage_name: str, data_interval_end, **_) -> NoReturn:
+    processing_date = get_processing_date(data_interval_end)
+    logger.info('loading stage %s for processing date %s', stage_name, processing_date)
+    with get_db_connection() as connection:
+        op_run_load_stage(stage_name, processing_date, connection, dim_load_mode=get_dim_load_mode())
+
+
+def generate_report(report_name: str, data_interval_end, **_) -> NoReturn:
+    processing_date = get_processing_date(data_interval_end)
+    logger.info('generating report %s for processing date %s', report_name, processing_date)
     with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            op_load_data_into_dwh(datetime.now(), cursor)
-            connection.commit()
+        op_run_report(report_name, processing_date, connection, get_dim_load_mode())
+
 
-def generate_reports() -> NoReturn:
+def load_data_to_dwh_for_dates(params, **_) -> list[list[str]]:
+    # загрузка для разных дат выполняется строго последовательно: контрольные точки в sevl_meta_info не позволяют
+    # загрузить более раннюю дату после более поздней
+    processing_dates = sorted(params['processing_dates'])
     with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            op_generate_reports(datetime.now(), cursor)
-            connection.commit()
+        for processing_date in processing_dates:
+            op_load_data_into_dwh(datetime.strptime(processing_date, PROCESSING_DATE_FORMAT), connection,
+                                  dim_load_mode=get_dim_load_mode())
+    return [[x] for x in processing_dates]
 
 
+def generate_report_for_date(processing_date: str, report_name: str) -> NoReturn:
+    with get_db_connection() as connection:
+        op_run_report(report_name, datetime.strptime(processing_date, PROCESSING_DATE_FORMAT), connection,
+                      get_dim_load_mode())
+
+
+# ежедневная загрузка: каждый источник загружается отдельной задачей, а зависимости между задачами повторяют
+# внешние ключи таблиц DWH; отчеты строятся параллельно после загрузки фактов.
+# Контрольные точки в sevl_meta_info не позволяют загрузить более раннюю дату после более поздней, поэтому запуски
+# выполняются по одному (max_active_runs=1), а каждая задача загрузки ждет успешного завершения этой же задачи в
+# предыдущем запуске (depends_on_past=True)
 dag = DAG(
     dag_id="etl-dag",
     schedule_interval='0 23 * * *',
     start_date=days_ago(2),
     catchup=False,
+    max_active_runs=1,
     tags=['etl', 'de'],
-    default_args={
-        'owner': 'Sergey Vershinin',
-        'email': 'sevlvershinin@edu.hse.ru',
-        'email_on_failure': True,
-        'email_on_retry': False,
-        'retry': 1,
-        'retry-delay': timedelta(minutes=1)
-
-    }
+    default_args=default_args,
 )
 
-task_init = PythonOperator(task_id='init', python_callable=init, dag=dag)
-task_load_data_to_dwh = PythonOperator(
-    task_id='load_data_to_dwh',
-    python_callable=load_data_to_dwh,
-    dag=dag,
+load_tasks = {
+    stage_name: PythonOperator(
+        task_id=f'load_{stage_name}',
+        python_callable=load_stage,
+        op_kwargs={'stage_name': stage_name},
+        depends_on_past=True,
+        dag=dag,
+    )
+    for stage_name in LOAD_STAGES
+}
+report_tasks = {
+    report_name: PythonOperator(
+        task_id=f'generate_report_{report_name}',
+        python_callable=generate_report,
+        op_kwargs={'report_name': report_name},
+        dag=dag,
+    )
+    for report_name in REPORTS
+}
+
+load_tasks['clients'] >> load_tasks['accounts'] >> load_tasks['cards']
+[load_tasks['cards'], load_tasks['terminals']] >> load_tasks['transactions']
+load_tasks['transactions'] >> list(report_tasks.values())
+load_tasks['passport_blacklist'] >> report_tasks['passport_fraud']
+
+
+# загрузка за несколько дат (backfill): даты передаются параметром запуска, загрузка выполняется последовательно,
+# а построение отчетов - динамически созданными задачами по одной на каждую дату и каждый отчет; эти задачи
+# выполняются параллельно, так как контрольные точки отчетов хранятся отдельно для каждой даты отчета
+backfill_dag = DAG(
+    dag_id="etl-backfill-dag",
+    schedule_interval=None,
+    start_date=days_ago(2),
+    catchup=False,
+    max_active_runs=1,
+    tags=['etl', 'de', 'backfill'],
+    default_args=default_args,
+    params={
+        'processing_dates': Param([], type='array', description='даты в формате YYYYmmdd'),
+    },
 )
-task_generate_reports = PythonOperator(
-    task_id='generate_reports',
-    python_callable=generate_reports,
-    dag=dag,
+
+task_backfill_load_data_to_dwh = PythonOperator(
+    task_id='load_data_to_dwh',
+    python_callable=load_data_to_dwh_for_dates,
+    dag=backfill_dag,
 )
-task_init >> task_load_data_to_dwh >> task_generate_reports
+for report_name in REPORTS:
+    PythonOperator.partial(
+        task_id=f'generate_report_{report_name}',
+        python_callable=generate_report_for_date,
+        op_kwargs={'report_name': report_name},
+        dag=backfill_dag,
+    ).expand(op_args=task_backfill_load_data_to_dwh.output)
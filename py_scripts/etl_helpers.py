@@ -1,18 +1,41 @@
+from __future__ import annotations
+
 import datetime
+import os
 
-import pandas as pd
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Collection
 
 from .common_helpers import (
+    DIM_LOAD_MODE_SCD1,
+    DIM_LOAD_MODE_SCD2,
+    EFFECTIVE_FROM_FIELD_NAME,
+    EFFECTIVE_TO_FIELD_NAME,
+    MAX_EFFECTIVE_TO,
+    MIN_EFFECTIVE_FROM,
+    archived_file_path,
     datetime_to_string_repr,
-    move_file_to_processed_folder,
+    history_table_name,
+    open_archived_file,
     sql_column_list,
     sql_value_placeholders
 )
+from .logger import logger
+from .meta_info import (
+    METADATA_TABLE_FULL_NAME,
+    deleted_rows_checkpoint_name,
+    get_max_update_timestamp,
+    set_max_update_timestamp
+)
+
+# pandas (а через него numpy и openpyxl) импортируется только внутри функций, которые с ним работают, чтобы импорт
+# модуля не замедлял запуск main.py и разбор DAG планировщиком Airflow
+if TYPE_CHECKING:
+    import pandas as pd
 
 UPDATE_DT_FIELD_NAME = 'update_dt'
 CREATE_DT_FIELD_NAME = 'create_dt'
-METADATA_TABLE_FULL_NAME = 'public.sevl_meta_info'
+REJECT_REASON_FIELD_NAME = 'reject_reason'
+REJECT_DT_FIELD_NAME = 'reject_dt'
 
 
 def load_dim_data_from_source_xls(
@@ -24,8 +47,9 @@ def load_dim_data_from_source_xls(
         staging_table_columns: list[str],
         target_table_full_name: str,
         target_table_columns: list[str],
-        cursor
-):
+        cursor,
+        dim_load_mode: str = DIM_LOAD_MODE_SCD1
+) -> list[str]:
     """
     Выполняет загрузку данных из исходного xls-файла с ежедневной полной выгрузкой значений измерения в соответствующую
     таблицу в DWH. Имя файла на диске должно иметь формат source_xls_filename_DDMMYYYY.xlsx, где DDMMYYYY - дата,
@@ -38,7 +62,11 @@ def load_dim_data_from_source_xls(
     CREATE_DT_FIELD_NAME и UPDATE_DT_FIELD_NAME
 
     В случае, если current_date меньше или равна дате последнего обновления данных (т.е. ранее в DWH уже были загружены
-    более свежие данные), то функция не выполняет обработку xls-файла.
+    более свежие данные), то функция не выполняет обработку xls-файла, а оставляет его на месте с предупреждением в
+    журнале (файл не возвращается в списке файлов для переноса в архив).
+
+    Функция не переносит файл в архив: это должно выполняться вызывающим кодом только после фиксации транзакции,
+    чтобы откат транзакции не оставлял в архиве незагруженные файлы.
 
     :param source_xls_filename: имя xls-файла с данными измерения (без расширения и даты)
     :param source_xls_sheet_name: имя листа в xls-файле
@@ -55,34 +83,45 @@ def load_dim_data_from_source_xls(
     Первым в списке должен быть столбец первичного ключа, а порядок следования столбцов должен совпадать с порядком
     следования столбцов в стейдж-таблице
     :param cursor: курсор для доступа к БД
+    :param dim_load_mode: режим загрузки измерения (DIM_LOAD_MODE_SCD1 или DIM_LOAD_MODE_SCD2)
+    :return: список файлов, которые нужно перенести в архив после фиксации транзакции
     """
+    full_xls_filename = f"{source_xls_filename}_{datetime_to_string_repr(current_date)}.xlsx"
+
     # из таблицы с метаданными получаем дату последнего обновления данных
-    max_update_timestamp = _get_max_update_timestamp(staging_table_full_name, cursor)
+    max_update_timestamp = get_max_update_timestamp(staging_table_full_name, cursor)
 
-    # если файл содержит данные, предшествующие или равные дате последнего обновления, то мы их уже не обрабатываем
+    # если файл содержит данные, предшествующие или равные дате последнего обновления, то мы их уже не обрабатываем;
+    # такой файл не считается обработанным и не переносится в архив
     if current_date <= max_update_timestamp:
-        return
+        return _skip_source_files(full_xls_filename)
+
+    _clean_staging_table(staging_table_full_name, cursor)
 
     # получаем все данные из файла; так как они не в формате SCD1, то загружаем их целиком,
     # а датой их создания и обновления считаем текущую дату (такой подход приводит к тому,
     # что данные, пришедшие к нам впервые, будут "созданы" текущей датой, а те, которые уже есть
     # у нас в DWH - этой же датой "обновлены", что логично)
-    full_xls_filename = f"{source_xls_filename}_{datetime_to_string_repr(current_date)}.xlsx"
     df = _select_dim_changes_from_source_xls(full_xls_filename, source_xls_sheet_name, current_date)
 
     # выполняем дополнительную обработку датафрейма, если она указана среди аргументов
     if process_source_dataframe_fn:
         df = process_source_dataframe_fn(df)
 
-    # переносим файл в каталог archive с одновременным добавлением к нему расширения .backup
-    move_file_to_processed_folder(full_xls_filename)
-
     # далее вставляем полученные данные в стейдж-таблицу, используя ту же функцию, что и для загрузки из БД
     _insert_dim_changes_into_staging_table(df, staging_table_columns, staging_table_full_name, cursor)
     # так как файл содержит полный срез данных и мы загрузили его в стейдж-таблицу целиком, то и перечень ИД можно
     # получить из нее
     existing_source_ids = _select_existing_ids_from_source_table(staging_table_full_name, staging_table_columns, cursor)
 
+    # в режиме scd2 история обновляется до таблицы в DWH, чтобы строки без истории получили версии с еще не
+    # измененными значениями; файл содержит срез данных за день, поэтому изменения действуют с начала этого дня
+    if dim_load_mode == DIM_LOAD_MODE_SCD2:
+        _load_dim_changes_into_history_table(staging_table_full_name, staging_table_columns, target_table_full_name,
+                                             target_table_columns, existing_source_ids, current_date, cursor,
+                                             version_dt=datetime.datetime.combine(current_date.date(),
+                                                                                  datetime.time.min))
+
     # переносим полученные данные из стейдж-таблицы в DWH используя общую для измерений логику переноса
     _load_dim_changes_into_target_table(staging_table_full_name, staging_table_columns, target_table_full_name,
                                         target_table_columns, existing_source_ids, cursor)
@@ -90,6 +129,9 @@ def load_dim_data_from_source_xls(
     # записываем в таблицу с метаданными дату последнего обновления данных
     _set_max_update_timestamp_from_staging_table_data(staging_table_full_name, max_update_timestamp, cursor)
 
+    # если данные были прочитаны из архива, то исходного файла уже нет и переносить в архив нечего
+    return _existing_files(full_xls_filename)
+
 
 def load_dim_data_from_source_table(
         source_table_full_name,
@@ -100,7 +142,9 @@ def load_dim_data_from_source_table(
         target_table_full_name,
         target_table_columns,
         cursor,
-):
+        current_date: datetime.datetime | None = None,
+        dim_load_mode: str = DIM_LOAD_MODE_SCD1
+) -> list[str]:
     """
     Выполняет загрузку данных из таблицы-источника со значениями измерений в соответствующую таблицу в DWH. Для
     хранения дат создания и обновления записей таблица-источник, стейдж-таблица и таблица в DWH должны использовать
@@ -121,10 +165,14 @@ def load_dim_data_from_source_table(
     Первым в списке должен быть столбец первичного ключа, а порядок следования столбцов должен совпадать с порядком
     следования столбцов в стейдж-таблице
     :param cursor: курсор для доступа к БД
-    :return:
+    :param current_date: дата, для которой загружаются данные; в режиме DIM_LOAD_MODE_SCD2 используется как дата
+    окончания действия версий строк, удаленных в таблице-источнике
+    :param dim_load_mode: режим загрузки измерения (DIM_LOAD_MODE_SCD1 или DIM_LOAD_MODE_SCD2)
+    :return: список файлов, которые нужно перенести в архив (для таблицы-источника всегда пустой)
     """
     # из таблицы с метаданными получаем дату последнего обновления данных
-    max_update_timestamp = _get_max_update_timestamp(staging_table_full_name, cursor)
+    max_update_timestamp = get_max_update_timestamp(staging_table_full_name, cursor)
+    _clean_staging_table(staging_table_full_name, cursor)
 
     # загружаем изменившиеся с момента последнего обновления данные из таблицы-источника
     df = _select_dim_changes_from_source_table(max_update_timestamp, source_table_columns, source_table_full_name,
@@ -141,6 +189,12 @@ def load_dim_data_from_source_table(
     # сохраняем полученные данные в стейдж-таблице
     _insert_dim_changes_into_staging_table(df, staging_table_columns, staging_table_full_name, cursor)
 
+    # в режиме scd2 история обновляется до таблицы в DWH, чтобы строки без истории получили версии с еще не
+    # измененными значениями
+    if dim_load_mode == DIM_LOAD_MODE_SCD2:
+        _load_dim_changes_into_history_table(staging_table_full_name, staging_table_columns, target_table_full_name,
+                                             target_table_columns, existing_source_ids, current_date, cursor)
+
     # загружаем данные из стейдж-таблицы в таблицу в DWH
     _load_dim_changes_into_target_table(staging_table_full_name, staging_table_columns, target_table_full_name,
                                         target_table_columns, existing_source_ids, cursor)
@@ -148,6 +202,8 @@ def load_dim_data_from_source_table(
     # записываем в таблицу с метаданными дату последнего обновления данных
     _set_max_update_timestamp_from_staging_table_data(staging_table_full_name, max_update_timestamp, cursor)
 
+    return []
+
 
 def load_fact_data_from_source_xls(
         source_xls_filename: str,
@@ -160,15 +216,15 @@ def load_fact_data_from_source_xls(
         target_table_columns: list[str],
         cursor,
         update_existing_facts: bool = False
-):
+) -> list[str]:
     # формируем имя файла и функцию его загрузки в DataFrame
     full_xls_filename = f"{source_xls_filename}_{datetime_to_string_repr(current_date)}.xlsx"
 
     def load_file_data():
-        return _select_fact_changes_from_source_xls(full_xls_filename, source_xls_sheet_name)
+        return _select_fact_changes_from_source_xls(full_xls_filename, source_xls_sheet_name, current_date)
 
     # вызываем обобщенную функцию загрузку фактов в DWH
-    _load_fact_data_from_source_file(
+    is_loaded = _load_fact_data_from_source_file(
         load_file_data,
         current_date,
         process_source_dataframe_fn,
@@ -179,8 +235,10 @@ def load_fact_data_from_source_xls(
         cursor,
         update_existing_facts=update_existing_facts
     )
-    # переносим файл в каталог archive с одновременным добавлением к нему расширения .backup
-    move_file_to_processed_folder(full_xls_filename)
+    if not is_loaded:
+        return _skip_source_files(full_xls_filename)
+    # файл переносится в архив вызывающим кодом после фиксации транзакции
+    return _existing_files(full_xls_filename)
 
 
 def load_fact_data_from_source_txt(
@@ -193,16 +251,21 @@ def load_fact_data_from_source_txt(
         target_table_full_name: str,
         target_table_columns: list[str],
         cursor,
-        update_existing_facts: bool = False
-):
+        update_existing_facts: bool = False,
+        batch_size: int | None = None,
+        on_batch_loaded_fn: Callable[[object], None] | None = None,
+        foreign_keys_fn: Callable[[object], dict[str, Collection]] | None = None,
+        reject_table_full_name: str | None = None,
+        order_by_column: str | None = None
+) -> list[str]:
     # формируем имя файла и функцию его загрузки в DataFrame
     full_txt_filename = f"{source_txt_filename}_{datetime_to_string_repr(current_date)}.txt"
 
     def load_file_data():
-        return _select_fact_changes_from_source_txt(full_txt_filename, source_txt_separator)
+        return _select_fact_changes_from_source_txt(full_txt_filename, source_txt_separator, current_date)
 
     # вызываем обобщенную функцию загрузку фактов в DWH
-    _load_fact_data_from_source_file(
+    is_loaded = _load_fact_data_from_source_file(
         load_file_data,
         current_date,
         process_source_dataframe_fn,
@@ -211,10 +274,17 @@ def load_fact_data_from_source_txt(
         target_table_full_name,
         target_table_columns,
         cursor,
-        update_existing_facts=update_existing_facts
+        update_existing_facts=update_existing_facts,
+        batch_size=batch_size,
+        on_batch_loaded_fn=on_batch_loaded_fn,
+        foreign_keys_fn=foreign_keys_fn,
+        reject_table_full_name=reject_table_full_name,
+        order_by_column=order_by_column
     )
-    # переносим файл в каталог archive с одновременным добавлением к нему расширения .backup
-    move_file_to_processed_folder(full_txt_filename)
+    if not is_loaded:
+        return _skip_source_files(full_txt_filename)
+    # файл переносится в архив вызывающим кодом после фиксации транзакции
+    return _existing_files(full_txt_filename)
 
 
 def _load_fact_data_from_source_file(
@@ -226,11 +296,35 @@ def _load_fact_data_from_source_file(
         target_table_full_name: str,
         target_table_columns: list[str],
         cursor,
-        update_existing_facts: bool = False
-):
-    max_update_timestamp = _get_max_update_timestamp(staging_table_full_name, cursor)
+        update_existing_facts: bool = False,
+        batch_size: int | None = None,
+        on_batch_loaded_fn: Callable[[object], None] | None = None,
+        foreign_keys_fn: Callable[[object], dict[str, Collection]] | None = None,
+        reject_table_full_name: str | None = None,
+        order_by_column: str | None = None
+) -> bool:
+    """
+    Обобщенная загрузка фактов из файла в DWH. Возвращает False, если данные не загружались, так как current_date
+    меньше или равна дате последнего обновления данных.
+
+    Если задана функция foreign_keys_fn, то перед переносом в DWH строки проверяются на наличие значений внешних
+    ключей в соответствующих измерениях: функция вызывается с курсором и должна вернуть для каждого столбца
+    стейдж-таблицы, являющегося внешним ключом, коллекцию существующих значений ключа. Строки с неизвестными
+    значениями не загружаются в DWH, а сохраняются с указанием причины в таблице reject_table_full_name, которая
+    должна содержать все столбцы стейдж-таблицы и столбцы REJECT_REASON_FIELD_NAME и REJECT_DT_FIELD_NAME.
+
+    Если задан batch_size, то данные переносятся через стейдж-таблицу пакетами (микро-пакетами) не более чем по
+    batch_size строк. Функция on_batch_loaded_fn, если указана, вызывается с курсором после переноса каждого пакета,
+    пока его строки находятся в стейдж-таблице (в ней же вызывающий код может зафиксировать пакет в БД). Дата
+    последнего обновления данных сохраняется только после переноса всех пакетов, поэтому прерванная загрузка будет
+    повторена целиком (уже перенесенные факты при этом не дублируются).
+
+    Если задан order_by_column (столбец стейдж-таблицы), то перед разбиением на пакеты строки сортируются по этому
+    столбцу, чтобы пакеты поступали в порядке его возрастания независимо от порядка строк в файле.
+    """
+    max_update_timestamp = get_max_update_timestamp(staging_table_full_name, cursor)
     if current_date <= max_update_timestamp:
-        return
+        return False
 
     # загружаем данные из файла
     df = source_file_loader_fn()
@@ -239,20 +333,76 @@ def _load_fact_data_from_source_file(
     if process_source_dataframe_fn:
         df = process_source_dataframe_fn(df)
 
-    # сохраняем данные в стейдж-таблицу
-    _insert_fact_changes_into_staging_table(df, staging_table_columns, staging_table_full_name, cursor)
+    # отбраковываем строки с неизвестными значениями внешних ключей, чтобы они не приводили к ошибке переноса всех
+    # остальных строк
+    if foreign_keys_fn:
+        df, rejected_df = _split_rows_by_foreign_keys(df, staging_table_columns, foreign_keys_fn(cursor))
+        _insert_rejected_rows(rejected_df, current_date, staging_table_columns, reject_table_full_name, cursor)
+
+    if order_by_column:
+        df = df.sort_values(df.columns[staging_table_columns.index(order_by_column)], kind='stable')
+
+    batches = [df[i:i + batch_size] for i in range(0, len(df), batch_size)] if batch_size else [df]
+    for batch_df in batches:
+        # сохраняем данные в стейдж-таблицу
+        _clean_staging_table(staging_table_full_name, cursor)
+        _insert_fact_changes_into_staging_table(batch_df, staging_table_columns, staging_table_full_name, cursor)
 
-    # переносим полученные данные из стейдж-таблицы в DWH
-    _load_fact_changes_into_target_table(staging_table_full_name, staging_table_columns, target_table_full_name,
-                                         target_table_columns, cursor, update_existing_facts=update_existing_facts)
+        # переносим полученные данные из стейдж-таблицы в DWH
+        _load_fact_changes_into_target_table(staging_table_full_name, staging_table_columns, target_table_full_name,
+                                             target_table_columns, cursor, update_existing_facts=update_existing_facts)
+
+        if on_batch_loaded_fn:
+            on_batch_loaded_fn(cursor)
 
     # записываем в таблицу с метаданными current_date в качестве даты последнего обновления данных
-    _set_precalculated_max_update_timestamp(staging_table_full_name, current_date, cursor)
+    set_max_update_timestamp(staging_table_full_name, current_date, cursor)
+    return True
+
+
+def _split_rows_by_foreign_keys(df, staging_table_columns, foreign_keys):
+    import pandas as pd
+
+    staged_df = df.set_axis(staging_table_columns, axis=1)
+    reject_reasons = pd.Series(None, index=df.index, dtype=object)
+    for column, existing_keys in foreign_keys.items():
+        is_unknown_key = ~staged_df[column].isin(existing_keys) & reject_reasons.isna()
+        reject_reasons[is_unknown_key] = f'Неизвестное значение внешнего ключа {column}'
+
+    is_rejected = reject_reasons.notna()
+    return df[~is_rejected], staged_df[is_rejected].assign(**{REJECT_REASON_FIELD_NAME: reject_reasons[is_rejected]})
+
+
+def _insert_rejected_rows(rejected_df, current_date, staging_table_columns, reject_table_full_name, cursor):
+    # отбракованные при прерванной загрузке строки удаляются, так как файл будет проверен повторно
+    cursor.execute(f"DELETE FROM {reject_table_full_name} WHERE {REJECT_DT_FIELD_NAME} = %s", (current_date,))
+    if rejected_df.empty:
+        return
+
+    reject_table_columns = staging_table_columns + [REJECT_REASON_FIELD_NAME]
+    cursor.executemany(
+        f"INSERT INTO {reject_table_full_name}("
+        f"{sql_column_list(reject_table_columns)}, "
+        f"{REJECT_DT_FIELD_NAME}) "
+        f"VALUES ({sql_value_placeholders(reject_table_columns)}, %s)",
+        [row + [current_date] for row in rejected_df.values.tolist()])
+
+
+def _existing_files(*filenames: str) -> list[str]:
+    return [x for x in filenames if os.path.exists(x)]
+
 
+def _skip_source_files(*filenames: str) -> list[str]:
+    # файлы за даты, данные за которые уже загружены (например, поступившие с опозданием), не загружаются и не
+    # переносятся в архив, чтобы их данные не терялись незаметно
+    for filename in _existing_files(*filenames):
+        logger.warning(f'Файл {filename} не загружен, так как данные за эту дату или более позднюю уже загружены; '
+                       f'файл оставлен в исходном каталоге')
+    return []
 
-def _get_max_update_timestamp(table_name, cursor):
-    cursor.execute(f"select max_update_dt from {METADATA_TABLE_FULL_NAME} where table_name='{table_name}'")
-    return cursor.fetchone()[0]
+
+def _clean_staging_table(staging_table_full_name, cursor):
+    cursor.execute(f"DELETE FROM {staging_table_full_name};")
 
 
 def _set_max_update_timestamp_from_staging_table_data(table_name, prev_timestamp, cursor):
@@ -261,47 +411,59 @@ def _set_max_update_timestamp_from_staging_table_data(table_name, prev_timestamp
                    f"where table_name='{table_name}';", (prev_timestamp,))
 
 
-def _set_precalculated_max_update_timestamp(table_name, max_update_timestamp, cursor):
-    cursor.execute(f"update {METADATA_TABLE_FULL_NAME} "
-                   f"set max_update_dt = %s "
-                   f"where table_name='{table_name}';", (max_update_timestamp,))
-
-
 def _select_dim_changes_from_source_xls(filename: str, sheet_name: str,
                                         current_date: datetime.datetime) -> pd.DataFrame:
-    df = _load_xls(filename, sheet_name)
+    df = _load_xls(filename, sheet_name, current_date)
     df[CREATE_DT_FIELD_NAME] = current_date
     df[UPDATE_DT_FIELD_NAME] = current_date
     return df
 
 
-def _select_fact_changes_from_source_xls(filename: str, sheet_name: str) -> pd.DataFrame:
-    return _load_xls(filename, sheet_name)
+def _select_fact_changes_from_source_xls(filename: str, sheet_name: str,
+                                         current_date: datetime.datetime) -> pd.DataFrame:
+    return _load_xls(filename, sheet_name, current_date)
+
 
+def _select_fact_changes_from_source_txt(filename: str, separator: str,
+                                         current_date: datetime.datetime) -> pd.DataFrame:
+    return _load_txt(filename, separator, current_date)
 
-def _select_fact_changes_from_source_txt(filename: str, separator: str) -> pd.DataFrame:
-    return _load_txt(filename, separator)
 
+def _open_source_file(filename: str, current_date: datetime.datetime):
+    # если исходного файла уже нет, но он есть в архиве (повторная обработка данных после сброса даты последнего
+    # обновления в таблице с метаданными), то данные читаются непосредственно из сжатой копии в архиве
+    if not os.path.exists(filename) and os.path.exists(archived_file_path(filename, current_date)):
+        return open_archived_file(filename, current_date)
+    return open(filename, 'rb')
 
-def _load_xls(filename: str, sheet_name: str) -> pd.DataFrame:
-    df = pd.read_excel(
-        filename,
-        sheet_name=sheet_name,
-        header=0,
-        index_col=None)
+
+def _load_xls(filename: str, sheet_name: str, current_date: datetime.datetime) -> pd.DataFrame:
+    import pandas as pd
+
+    with _open_source_file(filename, current_date) as f:
+        df = pd.read_excel(
+            f,
+            sheet_name=sheet_name,
+            header=0,
+            index_col=None)
     return df
 
 
-def _load_txt(filename: str, separator: str) -> pd.DataFrame:
-    df = pd.read_csv(
-        filename,
-        header=0,
-        sep=separator,
-        index_col=None)
+def _load_txt(filename: str, separator: str, current_date: datetime.datetime) -> pd.DataFrame:
+    import pandas as pd
+
+    with _open_source_file(filename, current_date) as f:
+        df = pd.read_csv(
+            f,
+            header=0,
+            sep=separator,
+            index_col=None)
     return df
 
 
 def _select_dim_changes_from_source_table(max_update_timestamp, source_table_columns, source_table_full_name, cursor):
+    import pandas as pd
+
     cursor.execute(
         f"select "
         f"{sql_column_list(source_table_columns)}, "
@@ -379,11 +541,7 @@ def _load_dim_changes_into_target_table(staging_table_full_name, staging_table_c
                 inner join {target_table_full_name} tgt
                 on stg.{staging_table_pk} = tgt.{target_table_pk}
                 where 
-                    {" or ".join(f"(stg.{x} <> tgt.{y}"
-                                 f" or (stg.{x} is null and tgt.{y} is not null)"
-                                 f" or (stg.{x} is not null and tgt.{y} is null))"
-                                 for x, y in zip(staging_table_columns[1:], target_table_columns[1:])
-                                 )}
+                    {_sql_changed_columns_condition(staging_table_columns, target_table_columns, 'stg.', 'tgt.')}
             ) tmp
             where {target_table_full_name}.{target_table_pk} = tmp.{staging_table_pk};
             """
@@ -392,6 +550,102 @@ def _load_dim_changes_into_target_table(staging_table_full_name, staging_table_c
     # удаляем в DWH-таблице строк, которых больше нет в таблице-источнике.
     cursor.execute(f"delete from {target_table_full_name} where {target_table_pk} not in %s",
                    (existing_source_ids,))
+    # удаление строк не меняет дату последнего обновления данных, поэтому сохраняем дату удаления отдельно, чтобы
+    # кэш измерений загрузил измерение заново
+    if cursor.rowcount:
+        set_max_update_timestamp(deleted_rows_checkpoint_name(target_table_full_name), datetime.datetime.now(),
+                                 cursor)
+
+
+def _load_dim_changes_into_history_table(staging_table_full_name, staging_table_columns, target_table_full_name,
+                                         target_table_columns, existing_source_ids, current_date, cursor,
+                                         version_dt=None):
+    """
+    Переносит изменения измерения из стейдж-таблицы в таблицу с историей версий строк (SCD2): действие текущих версий
+    измененных строк завершается датой обновления строки, для новых и измененных строк создаются новые текущие версии,
+    а действие текущих версий строк, удаленных в источнике, завершается датой current_date.
+
+    Должна вызываться до переноса изменений в таблицу в DWH: строки таблицы в DWH, для которых еще нет истории
+    (например, загруженные до включения режима scd2), сначала получают текущие версии со своими значениями,
+    действующие с MIN_EFFECTIVE_FROM, и только после этого к ним применяются изменения.
+
+    Если задана version_dt, то она используется вместо дат создания и обновления строк как дата начала действия
+    новых версий и дата завершения действия предыдущих, а также вместо current_date для удаленных строк (для
+    измерений, загружаемых из ежедневных срезов, в которых даты создания и обновления - это дата обработки)
+    """
+    history_table_full_name = history_table_name(target_table_full_name)
+    staging_table_pk = staging_table_columns[0]
+    target_table_pk = target_table_columns[0]
+
+    # создаем версии для строк таблицы в DWH, у которых еще нет истории
+    query = f"""
+            insert into {history_table_full_name}(
+                {sql_column_list(target_table_columns)},
+                {EFFECTIVE_FROM_FIELD_NAME},
+                {EFFECTIVE_TO_FIELD_NAME})
+            select
+                {sql_column_list(target_table_columns, 'tgt.')},
+                '{MIN_EFFECTIVE_FROM}',
+                '{MAX_EFFECTIVE_TO}'
+            from {target_table_full_name} tgt
+            where not exists (
+                select 1
+                from {history_table_full_name} hst
+                where hst.{target_table_pk} = tgt.{target_table_pk}
+            );
+        """
+    cursor.execute(query)
+
+    # завершаем действие текущих версий строк, измененных в источнике
+    query = f"""
+            update {history_table_full_name} hst
+            set {EFFECTIVE_TO_FIELD_NAME} = greatest(hst.{EFFECTIVE_FROM_FIELD_NAME},
+                                                     coalesce(%(version_dt)s, stg.{UPDATE_DT_FIELD_NAME}))
+            from {staging_table_full_name} stg
+            where
+                hst.{target_table_pk} = stg.{staging_table_pk}
+                and hst.{EFFECTIVE_TO_FIELD_NAME} = '{MAX_EFFECTIVE_TO}'
+                and ({_sql_changed_columns_condition(staging_table_columns, target_table_columns, 'stg.', 'hst.')});
+        """
+    cursor.execute(query, {'version_dt': version_dt})
+
+    # создаем текущие версии для новых строк (действуют с даты создания строки) и для строк, действие текущих версий
+    # которых было завершено (действуют с даты завершения действия предыдущей версии или с даты обновления строки,
+    # если строка была удалена и снова появилась в источнике)
+    query = f"""
+            insert into {history_table_full_name}(
+                {sql_column_list(target_table_columns)},
+                {EFFECTIVE_FROM_FIELD_NAME},
+                {EFFECTIVE_TO_FIELD_NAME})
+            select
+                {sql_column_list(staging_table_columns, 'stg.')},
+                case
+                    when prev.max_effective_to is null then coalesce(%(version_dt)s, stg.{CREATE_DT_FIELD_NAME})
+                    else greatest(coalesce(%(version_dt)s, stg.{UPDATE_DT_FIELD_NAME}), prev.max_effective_to)
+                end,
+                '{MAX_EFFECTIVE_TO}'
+            from {staging_table_full_name} stg
+            left join lateral (
+                select max(hst.{EFFECTIVE_TO_FIELD_NAME}) as max_effective_to
+                from {history_table_full_name} hst
+                where hst.{target_table_pk} = stg.{staging_table_pk}
+            ) prev on true
+            where prev.max_effective_to is null or prev.max_effective_to <> '{MAX_EFFECTIVE_TO}';
+        """
+    cursor.execute(query, {'version_dt': version_dt})
+
+    # завершаем действие текущих версий строк, которых больше нет в источнике
+    cursor.execute(f"update {history_table_full_name} "
+                   f"set {EFFECTIVE_TO_FIELD_NAME} = greatest({EFFECTIVE_FROM_FIELD_NAME}, %s) "
+                   f"where {EFFECTIVE_TO_FIELD_NAME} = '{MAX_EFFECTIVE_TO}' and {target_table_pk} not in %s",
+                   (version_dt or current_date, existing_source_ids))
+
+
+def _sql_changed_columns_condition(staging_table_columns, target_table_columns, staging_prefix, target_prefix):
+    return " or ".join(f"({staging_prefix}{x} <> {target_prefix}{y}"
+                       f" or ({staging_prefix}{x} is null and {target_prefix}{y} is not null)"
+                       f" or ({staging_prefix}{x} is not null and {target_prefix}{y} is null))"
+                       for x, y in zip(staging_table_columns[1:], target_table_columns[1:]))
 
 
 def _load_fact_changes_into_target_table(staging_table_full_name, staging_table_columns, target_table_full_name,
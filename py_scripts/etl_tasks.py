@@ -1,46 +1,112 @@
 import datetime
+import os
 
+from py_scripts.aggregates import update_client_daily_features, update_client_passport_features
+from py_scripts.common_helpers import DIM_LOAD_MODE_SCD1, move_file_to_processed_folder
 from py_scripts.etl_helpers import (
     load_dim_data_from_source_table,
     load_dim_data_from_source_xls,
     load_fact_data_from_source_xls,
     load_fact_data_from_source_txt
 )
+from py_scripts.fraud_detector import insert_fraud_events, load_fraud_detector
 from py_scripts.logger import logger
+from py_scripts.meta_info import get_max_update_timestamp
+from py_scripts.report_generators import delete_report_events, mark_reports_generated
 
+TRANSACTIONS_STAGING_TABLE_FULL_NAME = 'public.sevl_stg_transactions'
+PASSPORT_BLACKLIST_STAGING_TABLE_FULL_NAME = 'public.sevl_stg_passport_blacklist'
 
-def load_data_into_dwh(current_date:datetime.datetime, cursor):
+
+def load_data_into_dwh(current_date: datetime.datetime, connection, source_folder: str = '.',
+                       dim_load_mode: str = DIM_LOAD_MODE_SCD1):
     """
-    Загрузка данных измерений и фактов в хранилище данных
+    Загрузка данных измерений и фактов в хранилище данных. Каждый этап (таблица) загружается в отдельной транзакции,
+    а контрольные точки этапов хранятся в sevl_meta_info, поэтому повторный запуск после сбоя продолжает загрузку с
+    этапа, на котором произошла ошибка
     :param current_date: "текущая" дата, для которой выполняется загрузка данных
-    :param cursor: курсор к БД
+    :param connection: соединение с БД
+    :param source_folder: каталог с исходными файлами
+    :param dim_load_mode: режим загрузки измерений (DIM_LOAD_MODE_SCD1 или DIM_LOAD_MODE_SCD2)
     """
     logger.info(f'ETL-процесс запущен для даты {current_date}')
-    # очистка стейдж-таблиц
-    _clean_staging_tables(cursor)
-
-    # загрузка данных измерений из БД-источника
-    _load_clients(cursor)
-    _load_accounts(cursor)
-    _load_cards(cursor)
-
-    # загрузка данных измерений из файлов
-    _load_terminals(cursor, current_date)
-
-    # загрузка фактов из файлов
-    _load_blacklist(cursor, current_date)
-    _load_transactions(current_date, cursor)
+    # этапы перечислены в LOAD_STAGES в порядке, соответствующем внешним ключам таблиц DWH
+    for stage_name in LOAD_STAGES:
+        run_load_stage(stage_name, current_date, connection, source_folder, dim_load_mode)
     logger.info(f'ETL-процесс завершен для даты {current_date}')
 
 
-def _clean_staging_tables(cursor):
-    staging_tables = ['terminals', 'passport_blacklist', 'transactions', 'accounts', 'cards', 'clients']
-    query = "\n".join([f"DELETE FROM public.sevl_stg_{table};" for table in staging_tables])
-    cursor.execute(query)
+def run_load_stage(stage_name: str, current_date: datetime.datetime, connection, source_folder: str = '.',
+                   dim_load_mode: str = DIM_LOAD_MODE_SCD1):
+    """
+    Выполняет один этап загрузки данных в отдельной транзакции. Исходные файлы этапа переносятся в архив только после
+    фиксации транзакции, поэтому при откате транзакции файлы остаются на месте и будут обработаны при повторном запуске
+    :param stage_name: имя этапа загрузки (ключ LOAD_STAGES)
+    :param current_date: "текущая" дата, для которой выполняется загрузка данных
+    :param connection: соединение с БД
+    :param source_folder: каталог с исходными файлами
+    :param dim_load_mode: режим загрузки измерений (DIM_LOAD_MODE_SCD1 или DIM_LOAD_MODE_SCD2)
+    """
+    logger.info(f'Этап загрузки {stage_name} запущен для даты {current_date}')
+    with connection.cursor() as cursor:
+        processed_files = LOAD_STAGES[stage_name](current_date, cursor, source_folder, dim_load_mode)
+    _commit_and_archive(processed_files, current_date, connection)
+    logger.info(f'Этап загрузки {stage_name} завершен для даты {current_date}')
 
 
-def _load_clients(cursor):
-    load_dim_data_from_source_table(
+def load_transactions_in_micro_batches(current_date: datetime.datetime, connection, source_folder: str = '.',
+                                       batch_size: int = 10000):
+    """
+    Загружает транзакции микро-пакетами и сразу после переноса каждого пакета в DWH проверяет его транзакции на
+    мошенничество с помощью FraudDetector, добавляя найденные события в отчет. Каждый пакет фиксируется в БД вместе
+    с найденными в нем событиями. После загрузки всех пакетов отчеты за дату отмечаются как построенные, чтобы
+    generate_reports не строил их повторно.
+
+    Правило о черном списке паспортов проверяется по данным, загруженным на момент поступления транзакций, поэтому
+    отчет passport_fraud отмечается как построенный, только если черный список за дату уже был загружен; иначе
+    generate_reports после загрузки черного списка заменит сформированные для этого отчета события.
+    :param current_date: "текущая" дата, для которой выполняется загрузка данных
+    :param connection: соединение с БД
+    :param source_folder: каталог с исходными файлами
+    :param batch_size: максимальное количество транзакций в микро-пакете
+    """
+    with connection.cursor() as cursor:
+        is_loaded = current_date <= get_max_update_timestamp(TRANSACTIONS_STAGING_TABLE_FULL_NAME, cursor)
+    if is_loaded:
+        run_load_stage('transactions', current_date, connection, source_folder)
+        return
+
+    logger.info(f'Загрузка транзакций микро-пакетами запущена для даты {current_date}')
+    report_date = current_date.date()
+    with connection.cursor() as cursor:
+        # события от прерванной загрузки удаляются, так как транзакции будут проверены повторно
+        delete_report_events(current_date, cursor)
+        report_names = ['contract_fraud', 'two_or_more_cities']
+        if current_date <= get_max_update_timestamp(PASSPORT_BLACKLIST_STAGING_TABLE_FULL_NAME, cursor):
+            report_names.append('passport_fraud')
+        fraud_detector = load_fraud_detector(current_date, cursor)
+
+        def score_batch(batch_cursor):
+            batch_cursor.execute(f"select trans_id, trans_date, card_num, terminal "
+                                 f"from {TRANSACTIONS_STAGING_TABLE_FULL_NAME} order by trans_date")
+            insert_fraud_events(fraud_detector.score_transactions(batch_cursor.fetchall(), report_date), batch_cursor)
+            connection.commit()
+
+        processed_files = _load_transactions(current_date, cursor, source_folder, DIM_LOAD_MODE_SCD1,
+                                             batch_size=batch_size, on_batch_loaded_fn=score_batch)
+        mark_reports_generated(current_date, report_names, cursor)
+    _commit_and_archive(processed_files, current_date, connection)
+    logger.info(f'Загрузка транзакций микро-пакетами завершена для даты {current_date}')
+
+
+def _commit_and_archive(processed_files, current_date, connection):
+    connection.commit()
+    for filename in processed_files:
+        move_file_to_processed_folder(filename, current_date)
+
+
+def _load_clients(current_date, cursor, source_folder, dim_load_mode):
+    files_to_archive = load_dim_data_from_source_table(
         source_table_full_name='info.clients',
         source_table_columns=['client_id', 'last_name', 'first_name', 'patronymic', 'date_of_birth',
                               'passport_num', 'passport_valid_to', 'phone'],
@@ -51,12 +117,16 @@ def _load_clients(cursor):
         target_table_full_name='public.sevl_dwh_dim_clients',
         target_table_columns=['client_id', 'last_name', 'first_name', 'patronymic', 'date_of_birth',
                               'passport_num', 'passport_valid_to', 'phone'],
-        cursor=cursor
+        cursor=cursor,
+        current_date=current_date,
+        dim_load_mode=dim_load_mode
     )
+    update_client_passport_features('public.sevl_stg_clients', 'client_id', cursor)
+    return files_to_archive
 
 
-def _load_accounts(cursor):
-    load_dim_data_from_source_table(
+def _load_accounts(current_date, cursor, source_folder, dim_load_mode):
+    return load_dim_data_from_source_table(
         source_table_full_name='info.accounts',
         source_table_columns=['account', 'valid_to', 'client'],
         process_source_dataframe_fn=None,
@@ -64,12 +134,14 @@ def _load_accounts(cursor):
         staging_table_columns=['account_num', 'valid_to', 'client'],
         target_table_full_name='public.sevl_dwh_dim_accounts',
         target_table_columns=['account_num', 'valid_to', 'client'],
-        cursor=cursor
+        cursor=cursor,
+        current_date=current_date,
+        dim_load_mode=dim_load_mode
     )
 
 
-def _load_cards(cursor):
-    load_dim_data_from_source_table(
+def _load_cards(current_date, cursor, source_folder, dim_load_mode):
+    return load_dim_data_from_source_table(
         source_table_full_name='info.cards',
         source_table_columns=['card_num', 'account'],
         process_source_dataframe_fn=None,
@@ -78,12 +150,14 @@ def _load_cards(cursor):
         target_table_full_name='public.sevl_dwh_dim_cards',
         target_table_columns=['card_num', 'account_num'],
         cursor=cursor,
+        current_date=current_date,
+        dim_load_mode=dim_load_mode
     )
 
 
-def _load_terminals(cursor, current_date):
-    load_dim_data_from_source_xls(
-        source_xls_filename='terminals',
+def _load_terminals(current_date, cursor, source_folder, dim_load_mode):
+    return load_dim_data_from_source_xls(
+        source_xls_filename=os.path.join(source_folder, 'terminals'),
         source_xls_sheet_name='terminals',
         current_date=current_date,
         process_source_dataframe_fn=None,
@@ -91,43 +165,78 @@ def _load_terminals(cursor, current_date):
         staging_table_columns=['terminal_id', 'terminal_type', 'terminal_city', 'terminal_address'],
         target_table_full_name='public.sevl_dwh_dim_terminals',
         target_table_columns=['terminal_id', 'terminal_type', 'terminal_city', 'terminal_address'],
-        cursor=cursor
+        cursor=cursor,
+        dim_load_mode=dim_load_mode
     )
 
 
-def _load_blacklist(cursor, cur_date):
+def _load_blacklist(current_date, cursor, source_folder, dim_load_mode):
     def reorder_columns(df):
         return df[['passport', 'date']]
 
-    load_fact_data_from_source_xls(
-        source_xls_filename='passport_blacklist',
+    files_to_archive = load_fact_data_from_source_xls(
+        source_xls_filename=os.path.join(source_folder, 'passport_blacklist'),
         source_xls_sheet_name='blacklist',
-        current_date=cur_date,
+        current_date=current_date,
         process_source_dataframe_fn=reorder_columns,
-        staging_table_full_name='public.sevl_stg_passport_blacklist',
+        staging_table_full_name=PASSPORT_BLACKLIST_STAGING_TABLE_FULL_NAME,
         staging_table_columns=['passport_num', 'entry_dt'],
         target_table_full_name='public.sevl_dwh_fact_passport_blacklist',
         target_table_columns=['passport_num', 'entry_dt'],
         cursor=cursor
     )
+    # паспорт мог попасть в черный список после загрузки транзакций клиента за прошлые дни
+    update_client_passport_features(PASSPORT_BLACKLIST_STAGING_TABLE_FULL_NAME, 'passport_num', cursor)
+    return files_to_archive
+
+
+def _load_transactions(current_date, cursor, source_folder, dim_load_mode, batch_size=None, on_batch_loaded_fn=None):
+    def existing_card_and_terminal_keys(fk_cursor):
+        # ключи загружаются непосредственно из измерений, а не из кэша измерений, так как кэш не обновляется при
+        # удалении строк и пропустил бы транзакции, перенос которых нарушит внешние ключи
+        fk_cursor.execute("select card_num from public.sevl_dwh_dim_cards")
+        card_nums = {r[0] for r in fk_cursor.fetchall()}
+        fk_cursor.execute("select terminal_id from public.sevl_dwh_dim_terminals")
+        terminal_ids = {r[0] for r in fk_cursor.fetchall()}
+        return {'card_num': card_nums, 'terminal': terminal_ids}
+
+    def update_aggregates(batch_cursor):
+        # агрегат обновляется по каждому перенесенному пакету транзакций, пока они находятся в стейдж-таблице
+        update_client_daily_features(TRANSACTIONS_STAGING_TABLE_FULL_NAME, batch_cursor)
+        if on_batch_loaded_fn:
+            on_batch_loaded_fn(batch_cursor)
 
-
-def _load_transactions(cur_date, cursor):
     def replace_decimal_sep_and_add_space_to_card_numbers(df):
         df['amount'] = df['amount'].str.replace(',', '.')
         df['card_num'] = df['card_num'] + ' '
         return df
 
-    load_fact_data_from_source_txt(
-        source_txt_filename='transactions',
+    return load_fact_data_from_source_txt(
+        source_txt_filename=os.path.join(source_folder, 'transactions'),
         source_txt_separator=';',
-        current_date=cur_date,
+        current_date=current_date,
         process_source_dataframe_fn=replace_decimal_sep_and_add_space_to_card_numbers,
-        staging_table_full_name='public.sevl_stg_transactions',
+        staging_table_full_name=TRANSACTIONS_STAGING_TABLE_FULL_NAME,
         staging_table_columns=['trans_id', 'trans_date', 'amt', 'card_num', 'oper_type', 'oper_result',
                                'terminal'],
         target_table_full_name='public.sevl_dwh_fact_transactions',
         target_table_columns=['trans_id', 'trans_date', 'amt', 'card_num', 'oper_type', 'oper_result',
                               'terminal'],
-        cursor=cursor
+        cursor=cursor,
+        batch_size=batch_size,
+        on_batch_loaded_fn=update_aggregates,
+        foreign_keys_fn=existing_card_and_terminal_keys,
+        reject_table_full_name='public.sevl_rej_transactions',
+        order_by_column='trans_date'
     )
+
+
+# этапы загрузки в порядке, соответствующем внешним ключам таблиц DWH
+LOAD_STAGES = {
+    'clients': _load_clients,
+    'accounts': _load_accounts,
+    'cards': _load_cards,
+    'terminals': _load_terminals,
+    'passport_blacklist': _load_blacklist,
+    'transactions': _load_transactions,
+}
@@ -0,0 +1,122 @@
+import datetime
+from collections import Counter, defaultdict, deque
+from collections.abc import Mapping
+from typing import Iterable
+
+from py_scripts.common_helpers import sql_column_list, sql_value_placeholders
+from py_scripts.dimension_cache import CardOwner, dimension_cache
+from py_scripts.report_generators import (
+    CONTRACT_FRAUD_EVENT_TYPE,
+    PASSPORT_FRAUD_EVENT_TYPE,
+    REPORT_TABLE_FULL_NAME,
+    TWO_OR_MORE_CITIES_EVENT_TYPE
+)
+
+REPORT_TABLE_COLUMNS = ['event_dt', 'passport', 'fio', 'phone', 'event_type', 'report_dt']
+MULTI_CITY_WINDOW = datetime.timedelta(hours=1)
+MAX_PASSPORT_VALID_TO = datetime.date(2100, 12, 31)
+
+
+class FraudDetector:
+    """
+    Проверяет транзакции по тем же правилам, что и отчеты из report_generators, но без обращения к БД: владельцы карт,
+    города терминалов и черный список паспортов хранятся в памяти, а для правила операций в разных городах хранится
+    скользящее окно операций каждого клиента за последний час.
+
+    Транзакции должны передаваться в порядке возрастания даты (в том числе между пакетами), так как окно операций
+    сдвигается по мере поступления транзакций.
+    """
+
+    def __init__(self, card_owners: Mapping[str, CardOwner], terminal_cities: Mapping[str, str],
+                 blacklisted_passports: set[str] | frozenset[str]):
+        self._card_owners = card_owners
+        self._terminal_cities = terminal_cities
+        self._blacklisted_passports = blacklisted_passports
+        # для каждого клиента - операции за последний час и количество этих операций в каждом городе
+        self._recent_operations = defaultdict(deque)
+        self._recent_cities = defaultdict(Counter)
+        self._multi_city_trans_ids = set()
+
+    def score_transactions(self, transactions: Iterable[tuple], report_date: datetime.date) -> list[tuple]:
+        """
+        Проверяет пакет транзакций и возвращает строки отчета о мошеннических операциях за дату report_date
+        :param transactions: транзакции в виде кортежей (trans_id, trans_date, card_num, terminal)
+        :param report_date: дата отчета; транзакции за другие даты используются только для заполнения окна операций
+        :return: строки для вставки в таблицу отчета в порядке столбцов REPORT_TABLE_COLUMNS
+        """
+        events = []
+        for trans_id, trans_date, card_num, terminal in transactions:
+            owner = self._card_owners.get(card_num)
+            if owner is None:
+                continue
+
+            if trans_date.date() == report_date:
+                if ((owner.passport_valid_to or MAX_PASSPORT_VALID_TO) < report_date
+                        or owner.passport_num in self._blacklisted_passports):
+                    events.append(_event(trans_date, owner, PASSPORT_FRAUD_EVENT_TYPE, report_date))
+                if owner.account_valid_to < report_date:
+                    events.append(_event(trans_date, owner, CONTRACT_FRAUD_EVENT_TYPE, report_date))
+
+            city = self._terminal_cities.get(terminal)
+            if city is not None:
+                self._score_multi_city_operations(trans_id, trans_date, city, owner, report_date, events)
+        return events
+
+    def _score_multi_city_operations(self, trans_id, trans_date, city, owner, report_date, events):
+        operations = self._recent_operations[owner.client_id]
+        cities = self._recent_cities[owner.client_id]
+        operations.append((trans_date, trans_id, city))
+        cities[city] += 1
+
+        # удаляем из окна операции, совершенные более часа назад
+        while operations[0][0] < trans_date - MULTI_CITY_WINDOW:
+            _, _, expired_city = operations.popleft()
+            cities[expired_city] -= 1
+            if not cities[expired_city]:
+                del cities[expired_city]
+
+        # как и в отчете, мошенническими считаются все операции окна, в котором есть операции в разных городах
+        if len(cities) < 2:
+            return
+        for operation_date, operation_id, _ in operations:
+            if operation_id in self._multi_city_trans_ids:
+                continue
+            self._multi_city_trans_ids.add(operation_id)
+            if operation_date.date() == report_date:
+                events.append(_event(operation_date, owner, TWO_OR_MORE_CITIES_EVENT_TYPE, report_date))
+
+
+def _event(event_dt, owner, event_type, report_date):
+    return event_dt, owner.passport_num, owner.fio, owner.phone, event_type, report_date
+
+
+def load_fraud_detector(current_date: datetime.datetime, cursor) -> FraudDetector:
+    """
+    Создает FraudDetector на основе данных измерений из кэша измерений (обновляя устаревшие части кэша) и заполняет
+    окна операций клиентов транзакциями за последний час предыдущего дня
+    :param current_date: "текущая" дата, для которой будут проверяться транзакции
+    :param cursor: курсор к БД
+    """
+    dimension_cache.refresh(cursor)
+    fraud_detector = FraudDetector(dimension_cache.card_owners, dimension_cache.terminal_cities,
+                                   dimension_cache.blacklisted_passports)
+
+    report_date = current_date.date()
+    cursor.execute("""
+        select trans_id, trans_date, card_num, terminal
+        from public.sevl_dwh_fact_transactions
+        where trans_date >= %s::timestamp - interval '1' hour and trans_date < %s::timestamp
+        order by trans_date
+    """, (report_date, report_date))
+    fraud_detector.score_transactions(cursor.fetchall(), report_date)
+    return fraud_detector
+
+
+def insert_fraud_events(events: list[tuple], cursor) -> None:
+    """
+    Вставляет в таблицу отчета строки, сформированные FraudDetector
+    """
+    cursor.executemany(
+        f"INSERT INTO {REPORT_TABLE_FULL_NAME}({sql_column_list(REPORT_TABLE_COLUMNS)}) "
+        f"VALUES ({sql_value_placeholders(REPORT_TABLE_COLUMNS)})",
+        events)
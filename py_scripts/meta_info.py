@@ -0,0 +1,61 @@
+import datetime
+
+METADATA_TABLE_FULL_NAME = 'public.sevl_meta_info'
+# контрольные точки отчетов хранятся отдельно для каждой даты отчета, так как отчеты за разные даты могут строиться
+# в произвольном порядке
+REPORT_METADATA_TABLE_FULL_NAME = 'public.sevl_meta_report_info'
+DELETED_ROWS_CHECKPOINT_SUFFIX = '.deleted'
+
+
+def get_max_update_timestamp(table_name: str, cursor) -> datetime.datetime:
+    """
+    Возвращает сохраненную в таблице с метаданными дату последнего обновления (контрольную точку) для таблицы table_name
+    :param table_name: полное имя таблицы (или имя контрольной точки), включая имя схемы
+    :param cursor: курсор для доступа к БД
+    """
+    cursor.execute(f"select max_update_dt from {METADATA_TABLE_FULL_NAME} where table_name = %s", (table_name,))
+    return cursor.fetchone()[0]
+
+
+def deleted_rows_checkpoint_name(table_name: str) -> str:
+    """
+    Возвращает имя контрольной точки, в которой хранится дата последнего удаления строк из таблицы table_name
+    """
+    return table_name + DELETED_ROWS_CHECKPOINT_SUFFIX
+
+
+def set_max_update_timestamp(table_name: str, max_update_timestamp: datetime.datetime, cursor) -> None:
+    """
+    Сохраняет в таблице с метаданными дату последнего обновления (контрольную точку) для таблицы table_name
+    :param table_name: полное имя таблицы (или имя контрольной точки), включая имя схемы
+    :param max_update_timestamp: дата последнего обновления
+    :param cursor: курсор для доступа к БД
+    """
+    cursor.execute(f"update {METADATA_TABLE_FULL_NAME} "
+                   f"set max_update_dt = %s "
+                   f"where table_name = %s;", (max_update_timestamp, table_name))
+
+
+def is_report_generated(report_name: str, report_date: datetime.date, cursor) -> bool:
+    """
+    Проверяет, сохранена ли в таблице с метаданными отчетов контрольная точка отчета report_name за дату report_date
+    :param report_name: имя отчета
+    :param report_date: дата отчета
+    :param cursor: курсор для доступа к БД
+    """
+    cursor.execute(f"select 1 from {REPORT_METADATA_TABLE_FULL_NAME} where report_name = %s and report_dt = %s",
+                   (report_name, report_date))
+    return cursor.fetchone() is not None
+
+
+def set_report_generated(report_name: str, report_date: datetime.date, cursor) -> None:
+    """
+    Сохраняет в таблице с метаданными отчетов контрольную точку отчета report_name за дату report_date
+    :param report_name: имя отчета
+    :param report_date: дата отчета
+    :param cursor: курсор для доступа к БД
+    """
+    cursor.execute(f"insert into {REPORT_METADATA_TABLE_FULL_NAME}(report_name, report_dt, generate_dt) "
+                   f"values (%s, %s, localtimestamp(0)) "
+                   f"on conflict (report_name, report_dt) do update set generate_dt = excluded.generate_dt;",
+                   (report_name, report_date))
@@ -1,20 +1,98 @@
+from py_scripts.common_helpers import (
+    DIM_LOAD_MODE_SCD1,
+    DIM_LOAD_MODE_SCD2,
+    EFFECTIVE_FROM_FIELD_NAME,
+    EFFECTIVE_TO_FIELD_NAME,
+    history_table_name
+)
 from py_scripts.logger import logger
+from py_scripts.meta_info import is_report_generated, set_report_generated
 
+REPORT_TABLE_FULL_NAME = 'public.sevl_rep_fraud'
 
-def generate_reports(current_date, cursor):
+PASSPORT_FRAUD_EVENT_TYPE = 'Заблокированный или просроченный паспорт'
+CONTRACT_FRAUD_EVENT_TYPE = 'Недействующий договор'
+TWO_OR_MORE_CITIES_EVENT_TYPE = 'Совершение операций в разных городах за короткое время'
+
+# типы событий, которые формирует каждый отчет (ключи совпадают с ключами REPORTS)
+REPORT_EVENT_TYPES = {
+    'passport_fraud': PASSPORT_FRAUD_EVENT_TYPE,
+    'contract_fraud': CONTRACT_FRAUD_EVENT_TYPE,
+    'two_or_more_cities': TWO_OR_MORE_CITIES_EVENT_TYPE,
+}
+
+
+def generate_reports(current_date, connection, dim_load_mode=DIM_LOAD_MODE_SCD1):
     """
-    Выполняет генерацию отчетов для переданной даты
+    Выполняет генерацию отчетов для переданной даты. Каждый отчет строится в отдельной транзакции и имеет свою
+    контрольную точку для каждой даты отчета, поэтому повторный запуск не дублирует уже построенные отчеты, а отчеты
+    за разные даты можно строить в любом порядке
     :param current_date: "текущая" дата, для которой генерируются отчеты
-    :param cursor: курсор к БД
+    :param connection: соединение с БД
+    :param dim_load_mode: режим загрузки измерений; в режиме DIM_LOAD_MODE_SCD2 для каждой транзакции используются
+    версии строк измерений, действовавшие в момент ее совершения
     """
     logger.info(f'Процесс построения отчетов запущен для даты {current_date}')
-    _generate_report_for_passport_fraud(current_date, cursor)
-    _generate_report_for_contract_fraud(current_date, cursor)
-    _generate_report_for_two_or_more_cities_operations(current_date, cursor)
+    for report_name in REPORTS:
+        run_report(report_name, current_date, connection, dim_load_mode)
     logger.info(f'Процесс построения отчетов завершен для даты {current_date}')
 
 
-def _generate_report_for_passport_fraud(current_date, cursor):
+def run_report(report_name, current_date, connection, dim_load_mode=DIM_LOAD_MODE_SCD1):
+    """
+    Выполняет построение одного отчета в отдельной транзакции, если он еще не был построен для переданной даты.
+    Перед построением из таблицы отчета удаляются события этого отчета за дату (например, сформированные при загрузке
+    транзакций микро-пакетами), поэтому повторное построение не дублирует строки
+    :param report_name: имя отчета (ключ REPORTS)
+    :param current_date: "текущая" дата, для которой генерируется отчет
+    :param connection: соединение с БД
+    :param dim_load_mode: режим загрузки измерений (см. generate_reports)
+    """
+    report_date = current_date.date()
+    with connection.cursor() as cursor:
+        if is_report_generated(report_name, report_date, cursor):
+            logger.info(f'Отчет {report_name} для даты {current_date} уже построен')
+            return
+        cursor.execute(f"delete from {REPORT_TABLE_FULL_NAME} where event_type = %s and report_dt = %s",
+                       (REPORT_EVENT_TYPES[report_name], report_date))
+        REPORTS[report_name](current_date, cursor, dim_load_mode)
+        set_report_generated(report_name, report_date, cursor)
+    connection.commit()
+
+
+def mark_reports_generated(current_date, report_names, cursor):
+    """
+    Отмечает отчеты как построенные для переданной даты (используется, когда события мошенничества были
+    сформированы при загрузке транзакций микро-пакетами)
+    :param current_date: "текущая" дата, для которой были сформированы события
+    :param report_names: имена отчетов (ключи REPORTS)
+    :param cursor: курсор к БД
+    """
+    for report_name in report_names:
+        set_report_generated(report_name, current_date.date(), cursor)
+
+
+def delete_report_events(current_date, cursor):
+    """
+    Удаляет из отчета события, сформированные для переданной даты
+    :param current_date: "текущая" дата, для которой были сформированы события
+    :param cursor: курсор к БД
+    """
+    cursor.execute(f"delete from {REPORT_TABLE_FULL_NAME} where report_dt = %s", (current_date.date(),))
+
+
+def _dim_table(table_full_name, dim_load_mode):
+    return history_table_name(table_full_name) if dim_load_mode == DIM_LOAD_MODE_SCD2 else table_full_name
+
+
+def _as_of(alias, moment, dim_load_mode):
+    # условие записано в том же виде, что и ограничение-исключение таблицы с историей, чтобы использовался его индекс
+    if dim_load_mode != DIM_LOAD_MODE_SCD2:
+        return ''
+    return f" and tsrange({alias}.{EFFECTIVE_FROM_FIELD_NAME}, {alias}.{EFFECTIVE_TO_FIELD_NAME}) @> {moment}"
+
+
+def _generate_report_for_passport_fraud(current_date, cursor, dim_load_mode):
     query = f"""
         insert into public.sevl_rep_fraud(event_dt, passport, fio, phone, event_type, report_dt)
         select
@@ -22,15 +100,15 @@ def _generate_report_for_passport_fraud(current_date, cursor):
             cl.passport_num as passport,
             cl.last_name || ' ' || cl.first_name || ' ' || cl.patronymic as fio,
             cl.phone as phone,
-            'Заблокированный или просроченный паспорт' as event_type,
+            '{PASSPORT_FRAUD_EVENT_TYPE}' as event_type,
             %s as report_dt
         from public.sevl_dwh_fact_transactions tr
-        join public.sevl_dwh_dim_cards crd
-            on crd.card_num = tr.card_num
-        join public.sevl_dwh_dim_accounts acc
-            on acc.account_num = crd.account_num
-        join public.sevl_dwh_dim_clients cl
-            on cl.client_id = acc.client
+        join {_dim_table('public.sevl_dwh_dim_cards', dim_load_mode)} crd
+            on crd.card_num = tr.card_num{_as_of('crd', 'tr.trans_date', dim_load_mode)}
+        join {_dim_table('public.sevl_dwh_dim_accounts', dim_load_mode)} acc
+            on acc.account_num = crd.account_num{_as_of('acc', 'tr.trans_date', dim_load_mode)}
+        join {_dim_table('public.sevl_dwh_dim_clients', dim_load_mode)} cl
+            on cl.client_id = acc.client{_as_of('cl', 'tr.trans_date', dim_load_mode)}
         left join public.sevl_dwh_fact_passport_blacklist blk
             on blk.passport_num = cl.passport_num
         where
@@ -41,7 +119,7 @@ def _generate_report_for_passport_fraud(current_date, cursor):
     cursor.execute(query, (dt, dt, dt))
 
 
-def _generate_report_for_contract_fraud(current_date, cursor):
+def _generate_report_for_contract_fraud(current_date, cursor, dim_load_mode):
     query = f"""
         insert into public.sevl_rep_fraud(event_dt, passport, fio, phone, event_type, report_dt)
         select
@@ -49,15 +127,15 @@ def _generate_report_for_contract_fraud(current_date, cursor):
             cl.passport_num as passport,
             cl.last_name || ' ' || cl.first_name || ' ' || cl.patronymic as fio,
             cl.phone as phone,
-            'Недействующий договор' as event_type,
+            '{CONTRACT_FRAUD_EVENT_TYPE}' as event_type,
             %s as report_dt
         from public.sevl_dwh_fact_transactions tr
-        join public.sevl_dwh_dim_cards crd
-            on crd.card_num = tr.card_num
-        join public.sevl_dwh_dim_accounts acc
-            on acc.account_num = crd.account_num
-        join public.sevl_dwh_dim_clients cl
-            on cl.client_id = acc.client
+        join {_dim_table('public.sevl_dwh_dim_cards', dim_load_mode)} crd
+            on crd.card_num = tr.card_num{_as_of('crd', 'tr.trans_date', dim_load_mode)}
+        join {_dim_table('public.sevl_dwh_dim_accounts', dim_load_mode)} acc
+            on acc.account_num = crd.account_num{_as_of('acc', 'tr.trans_date', dim_load_mode)}
+        join {_dim_table('public.sevl_dwh_dim_clients', dim_load_mode)} cl
+            on cl.client_id = acc.client{_as_of('cl', 'tr.trans_date', dim_load_mode)}
         where
             tr.trans_date::date = %s and 
             acc.valid_to < %s;
@@ -66,7 +144,7 @@ def _generate_report_for_contract_fraud(current_date, cursor):
     cursor.execute(query, (dt, dt, dt))
 
 
-def _generate_report_for_two_or_more_cities_operations(current_date, cursor):
+def _generate_report_for_two_or_more_cities_operations(current_date, cursor, dim_load_mode):
     query = f"""
         WITH extended_daily_transactions_data as
                  (SELECT tr.trans_id,
@@ -81,10 +159,14 @@ def _generate_report_for_two_or_more_cities_operations(current_date, cursor):
                              RANGE BETWEEN INTERVAL '1' HOUR PRECEDING AND CURRENT ROW
                              ) AS transaction_cities_last_hour
                   FROM public.sevl_dwh_fact_transactions tr
-                           JOIN public.sevl_dwh_dim_cards crd ON tr.card_num = crd.card_num
-                           JOIN public.sevl_dwh_dim_accounts acc ON crd.account_num = acc.account_num
-                           JOIN public.sevl_dwh_dim_clients clt ON acc.client = clt.client_id
-                           JOIN public.sevl_dwh_dim_terminals trm on tr.terminal = trm.terminal_id
+                           JOIN {_dim_table('public.sevl_dwh_dim_cards', dim_load_mode)} crd
+                                ON tr.card_num = crd.card_num{_as_of('crd', 'tr.trans_date', dim_load_mode)}
+                           JOIN {_dim_table('public.sevl_dwh_dim_accounts', dim_load_mode)} acc
+                                ON crd.account_num = acc.account_num{_as_of('acc', 'tr.trans_date', dim_load_mode)}
+                           JOIN {_dim_table('public.sevl_dwh_dim_clients', dim_load_mode)} clt
+                                ON acc.client = clt.client_id{_as_of('clt', 'tr.trans_date', dim_load_mode)}
+                           JOIN {_dim_table('public.sevl_dwh_dim_terminals', dim_load_mode)} trm
+                                ON tr.terminal = trm.terminal_id{_as_of('trm', 'tr.trans_date', dim_load_mode)}
                   WHERE tr.trans_date >= %s::timestamp - INTERVAL '1' HOUR
                     AND tr.trans_date < %s::timestamp + INTERVAL '1' DAY
                   ),
@@ -102,17 +184,24 @@ def _generate_report_for_two_or_more_cities_operations(current_date, cursor):
             cl.passport_num AS passport,
             cl.last_name || ' ' || cl.first_name || ' ' || cl.patronymic AS fio,
             cl.phone AS phone,
-            'Совершение операций в разных городах за короткое время' AS event_type,
+            '{TWO_OR_MORE_CITIES_EVENT_TYPE}' AS event_type,
             %s AS report_dt
         FROM sevl_dwh_fact_transactions tr
-        JOIN sevl_dwh_dim_cards crd
-        ON crd.card_num = tr.card_num
-        JOIN sevl_dwh_dim_accounts acc
-        ON acc.account_num = crd.account_num
-        JOIN sevl_dwh_dim_clients cl
-        ON cl.client_id = acc.client
+        JOIN {_dim_table('public.sevl_dwh_dim_cards', dim_load_mode)} crd
+        ON crd.card_num = tr.card_num{_as_of('crd', 'tr.trans_date', dim_load_mode)}
+        JOIN {_dim_table('public.sevl_dwh_dim_accounts', dim_load_mode)} acc
+        ON acc.account_num = crd.account_num{_as_of('acc', 'tr.trans_date', dim_load_mode)}
+        JOIN {_dim_table('public.sevl_dwh_dim_clients', dim_load_mode)} cl
+        ON cl.client_id = acc.client{_as_of('cl', 'tr.trans_date', dim_load_mode)}
         JOIN daily_fraud_transaction_ids fr_tr ON fr_tr.trans_id = tr.trans_id
         WHERE tr.trans_date::date = %s;
     """
     dt = current_date.date()
     cursor.execute(query, (dt, dt, dt, dt))
+
+
+REPORTS = {
+    'passport_fraud': _generate_report_for_passport_fraud,
+    'contract_fraud': _generate_report_for_contract_fraud,
+    'two_or_more_cities': _generate_report_for_two_or_more_cities_operations,
+}
@@ -2,6 +2,8 @@ import argparse
 import datetime
 from dataclasses import dataclass
 
+from py_scripts.common_helpers import DIM_LOAD_MODE_SCD1, DIM_LOAD_MODES
+
 @dataclass
 class Settings:
     host: str
@@ -10,6 +12,13 @@ class Settings:
     user: str
     password: str
     processing_dates: list[datetime.datetime]
+    watch: bool
+    landing_folder: str
+    poll_interval: float
+    queue_size: int
+    micro_batch_size: int
+    archive_retention_days: int | None
+    dim_load_mode: str
 
     def __init__(self):
         args = parser.parse_args()
@@ -19,6 +28,13 @@ class Settings:
         self.user = args.user
         self.password = args.password
         self.processing_dates = args.processing_dates
+        self.watch = args.watch
+        self.landing_folder = args.landing_folder
+        self.poll_interval = args.poll_interval
+        self.queue_size = args.queue_size
+        self.micro_batch_size = args.micro_batch_size
+        self.archive_retention_days = args.archive_retention_days
+        self.dim_load_mode = args.dim_load_mode
 
 
 parser = argparse.ArgumentParser(
@@ -88,3 +104,60 @@ parser.add_argument(
     default=[datetime.datetime.now()],
     metavar='<processing dates>',
 )
+
+parser.add_argument(
+    '--watch',
+    action='store_true',
+    help='режим непрерывной загрузки: файлы загружаются по мере их появления в каталоге, заданном --landing-folder',
+)
+
+parser.add_argument(
+    '--landing-folder',
+    type=str,
+    help='каталог, в котором находятся (или в который поступают в режиме --watch) файлы с выгрузками',
+    default='.',
+    metavar='<landing folder>',
+)
+
+parser.add_argument(
+    '--poll-interval',
+    type=float,
+    help='интервал проверки каталога с выгрузками в режиме --watch, в секундах',
+    default=10.0,
+    metavar='<seconds>',
+)
+
+parser.add_argument(
+    '--queue-size',
+    type=int,
+    help='максимальное количество файлов, ожидающих загрузки в режиме --watch',
+    default=16,
+    metavar='<queue size>',
+)
+
+parser.add_argument(
+    '--micro-batch-size',
+    type=int,
+    help='размер микро-пакета транзакций в режиме --watch; если задан, то транзакции проверяются на мошенничество '
+         'сразу после загрузки каждого пакета (0 - загрузка и построение отчетов целиком за день)',
+    default=0,
+    metavar='<batch size>',
+)
+
+parser.add_argument(
+    '--archive-retention-days',
+    type=int,
+    help='срок хранения загруженных файлов в архиве в днях, отсчитываемый от даты переноса файла в архив; '
+         'если не задан, то файлы хранятся бессрочно',
+    default=None,
+    metavar='<days>',
+)
+
+parser.add_argument(
+    '--dim-load-mode',
+    type=str,
+    choices=DIM_LOAD_MODES,
+    help='режим загрузки измерений: scd1 - перезапись строк, scd2 - дополнительно ведется история версий строк, '
+         'а отчеты используют версии, действовавшие в момент совершения транзакций',
+    default=DIM_LOAD_MODE_SCD1,
+)
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import datetime
+import os
+import re
+from typing import Callable
+
+from py_scripts.common_helpers import DIM_LOAD_MODE_SCD1, move_file_to_quarantine_folder, purge_processed_folder
+from py_scripts.etl_tasks import LOAD_STAGES, load_transactions_in_micro_batches, run_load_stage
+from py_scripts.logger import logger
+from py_scripts.meta_info import get_max_update_timestamp
+from py_scripts.report_generators import generate_reports
+
+# для каждого этапа загрузки - шаблон имени его файла (расширение файла определяется этапом, так как этап сам
+# формирует имя файла, который он загружает)
+SOURCE_FILE_NAME_PATTERNS = {
+    'terminals': re.compile(r'^terminals_(?P<date>\d{8})\.xlsx$'),
+    'passport_blacklist': re.compile(r'^passport_blacklist_(?P<date>\d{8})\.xlsx$'),
+    'transactions': re.compile(r'^transactions_(?P<date>\d{8})\.txt$'),
+}
+SOURCE_FILE_DATE_FORMAT = '%d%m%Y'
+
+# количество неудачных попыток загрузки неизменившегося файла, после которого он переносится в карантин
+MAX_LOAD_ATTEMPTS = 3
+
+# этапы загрузки из БД-источника, которые выполняются перед загрузкой транзакций, чтобы в DWH были все карты
+DB_SOURCE_STAGES = ['clients', 'accounts', 'cards']
+
+# контрольные точки, которые должны быть достигнуты для даты файла, прежде чем его можно загрузить
+STAGE_PREREQUISITES = {
+    'transactions': ['public.sevl_stg_terminals'],
+}
+# контрольные точки, которые должны быть достигнуты для даты, прежде чем для нее можно строить отчеты
+REPORT_PREREQUISITES = ['public.sevl_stg_transactions', 'public.sevl_stg_passport_blacklist']
+
+
+def watch_landing_folder(landing_folder: str, poll_interval: float, queue_size: int,
+                         get_db_connection_fn: Callable, micro_batch_size: int | None = None,
+                         archive_retention_days: int | None = None,
+                         dim_load_mode: str = DIM_LOAD_MODE_SCD1) -> None:
+    """
+    Запускает режим непрерывной загрузки: каталог landing_folder периодически проверяется на появление новых файлов
+    с выгрузками, и каждый файл загружается в DWH сразу после появления, после чего переносится в архив. Отчеты для
+    даты строятся, как только для нее загружены транзакции и черный список паспортов.
+
+    Найденные файлы передаются на загрузку через очередь ограниченного размера queue_size, поэтому при отставании
+    загрузки проверка каталога приостанавливается, а не накапливает необработанные файлы в памяти. Файлы загружаются
+    последовательно одним обработчиком, так как контрольные точки в sevl_meta_info требуют загрузки дат по порядку.
+    Файлы за даты, данные за которые уже загружены (поступившие с опозданием или не по порядку), не загружаются, а
+    переносятся с предупреждением в каталог QUARANTINE_FILE_FOLDER. Туда же переносятся файлы, загрузка которых
+    завершилась ошибкой MAX_LOAD_ATTEMPTS раз подряд без изменения файла.
+
+    :param landing_folder: каталог, в который поступают файлы с выгрузками
+    :param poll_interval: интервал проверки каталога в секундах; файл считается полностью записанным, если его размер
+    и дата изменения не изменились между двумя последовательными проверками
+    :param queue_size: максимальное количество файлов, ожидающих загрузки
+    :param get_db_connection_fn: функция, возвращающая новое соединение с БД
+    :param micro_batch_size: если задан, то транзакции загружаются и проверяются на мошенничество микро-пакетами
+    указанного размера (см. load_transactions_in_micro_batches)
+    :param archive_retention_days: если задан, то при каждой проверке каталога из архива удаляются файлы, перенесенные
+    в архив более указанного количества дней назад
+    :param dim_load_mode: режим загрузки измерений (DIM_LOAD_MODE_SCD1 или DIM_LOAD_MODE_SCD2)
+    """
+    asyncio.run(_watch_landing_folder(landing_folder, poll_interval, queue_size, get_db_connection_fn,
+                                      micro_batch_size, archive_retention_days, dim_load_mode))
+
+
+async def _watch_landing_folder(landing_folder, poll_interval, queue_size, get_db_connection_fn, micro_batch_size,
+                                archive_retention_days, dim_load_mode):
+    queue = asyncio.Queue(maxsize=queue_size)
+    queued_files = set()
+    logger.info(f'Режим непрерывной загрузки запущен для каталога {landing_folder}')
+    consumer = asyncio.create_task(_process_source_files(queue, queued_files, landing_folder, get_db_connection_fn,
+                                                         micro_batch_size, dim_load_mode))
+    file_stats = {}
+    try:
+        while True:
+            ready_files, file_stats = _find_ready_source_files(landing_folder, file_stats)
+            for current_date, stage_name, filename, file_stat in ready_files:
+                if filename in queued_files:
+                    continue
+                queued_files.add(filename)
+                await queue.put((current_date, stage_name, filename, file_stat))
+            if archive_retention_days is not None:
+                purge_processed_folder(archive_retention_days)
+            await asyncio.sleep(poll_interval)
+    finally:
+        consumer.cancel()
+
+
+async def _process_source_files(queue, queued_files, landing_folder, get_db_connection_fn, micro_batch_size,
+                                dim_load_mode):
+    # для каждого файла - размер и дата изменения файла и количество неудачных попыток его загрузки подряд
+    load_failures = {}
+    while True:
+        current_date, stage_name, filename, file_stat = await queue.get()
+        try:
+            await asyncio.to_thread(_load_source_file, current_date, stage_name, filename, landing_folder,
+                                    get_db_connection_fn, micro_batch_size, dim_load_mode)
+            load_failures.pop(filename, None)
+        except Exception:
+            logger.exception(f'Ошибка загрузки файла {filename}')
+            # попытки считаются заново, если файл изменился
+            failed_file_stat, failures_count = load_failures.get(filename, (file_stat, 0))
+            failures_count = failures_count + 1 if failed_file_stat == file_stat else 1
+            if failures_count < MAX_LOAD_ATTEMPTS:
+                # файл остается в каталоге и будет повторно загружен при следующей проверке
+                load_failures[filename] = (file_stat, failures_count)
+            else:
+                load_failures.pop(filename, None)
+                if os.path.exists(filename):
+                    quarantined_filename = move_file_to_quarantine_folder(filename)
+                    logger.error(f'Файл {filename} перенесен в {quarantined_filename} после {failures_count} '
+                                 f'неудачных попыток загрузки')
+        finally:
+            queued_files.discard(filename)
+            queue.task_done()
+
+
+def _find_ready_source_files(landing_folder, previous_file_stats):
+    """
+    Возвращает отсортированные по дате и порядку этапов загрузки файлы с выгрузками (дата, этап, путь, размер и дата
+    изменения), размер и дата изменения которых совпадают с полученными при предыдущей проверке
+    (previous_file_stats), а также размеры и даты изменения всех найденных файлов для следующей проверки. Дата изменения сама по себе не говорит о том, что запись файла
+    завершена, так как при копировании с сохранением дат (cp -p, rsync -t) она устанавливается заранее
+    """
+    stage_order = list(LOAD_STAGES)
+    ready_files = []
+    file_stats = {}
+    for entry in os.scandir(landing_folder):
+        stage_name, match = _match_source_file_name(entry.name)
+        if not match or not entry.is_file():
+            continue
+        stat = entry.stat()
+        file_stats[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        if previous_file_stats.get(entry.path) != file_stats[entry.path]:
+            continue
+        current_date = datetime.datetime.strptime(match['date'], SOURCE_FILE_DATE_FORMAT)
+        ready_files.append((current_date, stage_name, entry.path, file_stats[entry.path]))
+    return sorted(ready_files, key=lambda x: (x[0], stage_order.index(x[1]))), file_stats
+
+
+def _match_source_file_name(name):
+    for stage_name, pattern in SOURCE_FILE_NAME_PATTERNS.items():
+        match = pattern.match(name)
+        if match:
+            return stage_name, match
+    return None, None
+
+
+def _load_source_file(current_date, stage_name, filename, landing_folder, get_db_connection_fn, micro_batch_size,
+                      dim_load_mode):
+    # в режиме непрерывной загрузки соединение нужно явно закрывать, чтобы не накапливать их за время работы процесса
+    with contextlib.closing(get_db_connection_fn()) as connection, connection:
+        if not _checkpoints_reached(STAGE_PREREQUISITES.get(stage_name, []), current_date, connection):
+            logger.info(f'Загрузка {stage_name} для даты {current_date} отложена до загрузки зависимых данных')
+            return
+
+        if stage_name == 'transactions':
+            for db_stage_name in DB_SOURCE_STAGES:
+                run_load_stage(db_stage_name, current_date, connection, landing_folder, dim_load_mode)
+
+        if stage_name == 'transactions' and micro_batch_size:
+            load_transactions_in_micro_batches(current_date, connection, landing_folder, micro_batch_size)
+        else:
+            run_load_stage(stage_name, current_date, connection, landing_folder, dim_load_mode)
+
+        # загруженный файл переносится этапом загрузки в архив, поэтому оставшийся на месте файл не был загружен, так
+        # как данные за его дату уже загружены; он переносится в карантин, чтобы не проверяться повторно
+        if os.path.exists(filename):
+            quarantined_filename = move_file_to_quarantine_folder(filename)
+            logger.warning(f'Файл {filename} перенесен в {quarantined_filename}, так как данные за дату {current_date} '
+                           f'уже загружены')
+
+        if _checkpoints_reached(REPORT_PREREQUISITES, current_date, connection):
+            generate_reports(current_date, connection, dim_load_mode)
+
+
+def _checkpoints_reached(checkpoint_names, current_date, connection):
+    with connection.cursor() as cursor:
+        return all(current_date <= get_max_update_timestamp(x, cursor) for x in checkpoint_names)
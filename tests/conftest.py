@@ -0,0 +1,5 @@
+import os
+import sys
+
+# модули проекта импортируются из корня репозитория (как при запуске main.py и разборе DAG)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
@@ -0,0 +1,66 @@
+"""
+Проверка целостности DAG без запуска планировщика: файл с DAG загружается через DagBag, после чего проверяются
+отсутствие ошибок импорта, состав задач и зависимости между ними
+"""
+import os
+
+import pytest
+
+pytest.importorskip('airflow.models')
+
+from airflow.models import DagBag
+
+DAG_FILE = os.path.join(os.path.dirname(__file__), os.pardir, 'py_scripts', 'etl-dag.py')
+
+LOAD_TASK_IDS = ['load_clients', 'load_accounts', 'load_cards', 'load_terminals', 'load_passport_blacklist',
+                 'load_transactions']
+REPORT_TASK_IDS = ['generate_report_passport_fraud', 'generate_report_contract_fraud',
+                   'generate_report_two_or_more_cities']
+
+
+@pytest.fixture(scope='module')
+def dag_bag():
+    return DagBag(dag_folder=DAG_FILE, include_examples=False)
+
+
+def test_no_import_errors(dag_bag):
+    assert dag_bag.import_errors == {}
+    assert set(dag_bag.dag_ids) == {'etl-dag', 'etl-backfill-dag'}
+
+
+def test_etl_dag_task_ids(dag_bag):
+    dag = dag_bag.get_dag('etl-dag')
+    assert set(dag.task_ids) == set(LOAD_TASK_IDS + REPORT_TASK_IDS)
+
+
+def test_runs_are_serialized(dag_bag):
+    # контрольные точки загрузки допускают только загрузку дат по порядку
+    assert dag_bag.get_dag('etl-dag').max_active_runs == 1
+    assert dag_bag.get_dag('etl-backfill-dag').max_active_runs == 1
+    dag = dag_bag.get_dag('etl-dag')
+    for task_id in LOAD_TASK_IDS:
+        assert dag.get_task(task_id).depends_on_past
+
+
+def test_etl_dag_dependencies_follow_foreign_keys(dag_bag):
+    dag = dag_bag.get_dag('etl-dag')
+
+    def upstream(task_id):
+        return dag.get_task(task_id).upstream_task_ids
+
+    assert upstream('load_clients') == set()
+    assert upstream('load_accounts') == {'load_clients'}
+    assert upstream('load_cards') == {'load_accounts'}
+    assert upstream('load_terminals') == set()
+    assert upstream('load_passport_blacklist') == set()
+    assert upstream('load_transactions') == {'load_cards', 'load_terminals'}
+    assert upstream('generate_report_passport_fraud') == {'load_transactions', 'load_passport_blacklist'}
+    assert upstream('generate_report_contract_fraud') == {'load_transactions'}
+    assert upstream('generate_report_two_or_more_cities') == {'load_transactions'}
+
+
+def test_backfill_dag_reports_follow_load(dag_bag):
+    dag = dag_bag.get_dag('etl-backfill-dag')
+    assert set(dag.task_ids) == {'load_data_to_dwh'} | set(REPORT_TASK_IDS)
+    for task_id in REPORT_TASK_IDS:
+        assert dag.get_task(task_id).upstream_task_ids == {'load_data_to_dwh'}
@@ -0,0 +1,171 @@
+"""
+Проверка того, что FraudDetector находит те же события, что и SQL-отчеты из report_generators. Для сравнения
+правила отчетов воспроизводятся в reference_events по тексту запросов: отчеты за дату строятся по транзакциям этой
+даты, а окно операций клиента - RANGE BETWEEN INTERVAL '1' HOUR PRECEDING AND CURRENT ROW по транзакциям начиная с
+последнего часа предыдущего дня
+"""
+import datetime
+import random
+
+from py_scripts.dimension_cache import CardOwner
+from py_scripts.fraud_detector import FraudDetector
+from py_scripts.report_generators import (
+    CONTRACT_FRAUD_EVENT_TYPE,
+    PASSPORT_FRAUD_EVENT_TYPE,
+    TWO_OR_MORE_CITIES_EVENT_TYPE
+)
+
+REPORT_DATE = datetime.date(2021, 3, 2)
+VALID_TO = datetime.date(2030, 1, 1)
+TERMINAL_CITIES = {'T1': 'Москва', 'T2': 'Москва', 'T3': 'Казань', 'T4': 'Омск'}
+
+
+def owner(client_id, passport_valid_to=VALID_TO, account_valid_to=VALID_TO):
+    return CardOwner(client_id, f'P{client_id}', f'ФИО {client_id}', f'+7{client_id}', passport_valid_to,
+                     account_valid_to)
+
+
+def at(hour, minute=0, second=0, day=REPORT_DATE):
+    return datetime.datetime.combine(day, datetime.time(hour, minute, second))
+
+
+def score(card_owners, transactions, batch_size=None, blacklisted_passports=frozenset(),
+          previous_day_transactions=()):
+    fraud_detector = FraudDetector(card_owners, TERMINAL_CITIES, blacklisted_passports)
+    # как в load_fraud_detector: окна операций заполняются транзакциями последнего часа предыдущего дня
+    fraud_detector.score_transactions(previous_day_transactions, REPORT_DATE)
+    batch_size = batch_size or len(transactions) or 1
+    events = []
+    for i in range(0, len(transactions), batch_size):
+        events += fraud_detector.score_transactions(transactions[i:i + batch_size], REPORT_DATE)
+    return sorted(events)
+
+
+def reference_events(card_owners, transactions, blacklisted_passports=frozenset()):
+    events = []
+    known = [x for x in transactions if x[2] in card_owners]
+    for trans_id, trans_date, card_num, terminal in known:
+        if trans_date.date() != REPORT_DATE:
+            continue
+        card_owner = card_owners[card_num]
+        if ((card_owner.passport_valid_to or datetime.date(2100, 12, 31)) < REPORT_DATE
+                or card_owner.passport_num in blacklisted_passports):
+            events.append((trans_date, card_owner, PASSPORT_FRAUD_EVENT_TYPE))
+        if card_owner.account_valid_to < REPORT_DATE:
+            events.append((trans_date, card_owner, CONTRACT_FRAUD_EVENT_TYPE))
+
+    window_start = datetime.datetime.combine(REPORT_DATE, datetime.time.min) - datetime.timedelta(hours=1)
+    with_city = [x for x in known if x[3] in TERMINAL_CITIES and x[1] >= window_start]
+    fraud_trans_ids = set()
+    for _, trans_date, card_num, _ in with_city:
+        client_id = card_owners[card_num].client_id
+        window = [x for x in with_city
+                  if card_owners[x[2]].client_id == client_id
+                  and trans_date - datetime.timedelta(hours=1) <= x[1] <= trans_date]
+        if len({TERMINAL_CITIES[x[3]] for x in window}) > 1:
+            fraud_trans_ids.update(x[0] for x in window)
+    for trans_id, trans_date, card_num, _ in with_city:
+        if trans_id in fraud_trans_ids and trans_date.date() == REPORT_DATE:
+            events.append((trans_date, card_owners[card_num], TWO_OR_MORE_CITIES_EVENT_TYPE))
+
+    return sorted((event_dt, x.passport_num, x.fio, x.phone, event_type, REPORT_DATE)
+                  for event_dt, x, event_type in events)
+
+
+def event_types(events):
+    return [(x[0], x[4]) for x in events]
+
+
+def test_expired_passport():
+    card_owners = {
+        'C1': owner('1', passport_valid_to=REPORT_DATE - datetime.timedelta(days=1)),
+        'C2': owner('2', passport_valid_to=REPORT_DATE),
+        'C3': owner('3', passport_valid_to=None),
+    }
+    transactions = [('1', at(10), 'C1', 'T1'), ('2', at(11), 'C2', 'T1'), ('3', at(12), 'C3', 'T1')]
+    events = score(card_owners, transactions)
+    assert event_types(events) == [(at(10), PASSPORT_FRAUD_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions)
+
+
+def test_blacklisted_passport():
+    card_owners = {'C1': owner('1'), 'C2': owner('2')}
+    transactions = [('1', at(10), 'C1', 'T1'), ('2', at(11), 'C2', 'T1')]
+    events = score(card_owners, transactions, blacklisted_passports=frozenset({'P2'}))
+    assert event_types(events) == [(at(11), PASSPORT_FRAUD_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions, frozenset({'P2'}))
+
+
+def test_expired_account():
+    card_owners = {
+        'C1': owner('1', account_valid_to=REPORT_DATE - datetime.timedelta(days=1)),
+        'C2': owner('2', account_valid_to=REPORT_DATE),
+    }
+    transactions = [('1', at(10), 'C1', 'T1'), ('2', at(11), 'C2', 'T1')]
+    events = score(card_owners, transactions)
+    assert event_types(events) == [(at(10), CONTRACT_FRAUD_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions)
+
+
+def test_unknown_card_and_terminal_are_ignored():
+    card_owners = {'C1': owner('1', account_valid_to=REPORT_DATE - datetime.timedelta(days=1))}
+    transactions = [('1', at(10), 'C9', 'T1'), ('2', at(10, 10), 'C1', 'T9'), ('3', at(10, 20), 'C1', 'T3')]
+    events = score(card_owners, transactions)
+    assert event_types(events) == [(at(10, 10), CONTRACT_FRAUD_EVENT_TYPE), (at(10, 20), CONTRACT_FRAUD_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions)
+
+
+def test_multi_city_window_includes_operation_exactly_one_hour_before():
+    card_owners = {'C1': owner('1'), 'C2': owner('2')}
+    transactions = [
+        ('1', at(10), 'C1', 'T1'), ('2', at(11), 'C1', 'T3'),
+        ('3', at(10), 'C2', 'T1'), ('4', at(11, 0, 1), 'C2', 'T3'),
+    ]
+    events = score(card_owners, transactions)
+    assert event_types(events) == [(at(10), TWO_OR_MORE_CITIES_EVENT_TYPE), (at(11), TWO_OR_MORE_CITIES_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions)
+
+
+def test_multi_city_window_spans_batches():
+    card_owners = {'C1': owner('1'), 'C2': owner('1')}
+    transactions = [('1', at(10), 'C1', 'T1'), ('2', at(10, 20), 'C1', 'T2'), ('3', at(10, 40), 'C2', 'T3')]
+    # карты C1 и C2 принадлежат одному клиенту, а операция в другом городе приходит в следующем пакете
+    events = score(card_owners, transactions, batch_size=2)
+    assert event_types(events) == [(at(10), TWO_OR_MORE_CITIES_EVENT_TYPE),
+                                   (at(10, 20), TWO_OR_MORE_CITIES_EVENT_TYPE),
+                                   (at(10, 40), TWO_OR_MORE_CITIES_EVENT_TYPE)]
+    assert events == reference_events(card_owners, transactions)
+
+
+def test_multi_city_window_is_seeded_from_previous_day():
+    card_owners = {'C1': owner('1')}
+    previous_day = REPORT_DATE - datetime.timedelta(days=1)
+    previous_day_transactions = [('1', at(23, 30, day=previous_day), 'C1', 'T1')]
+    transactions = [('2', at(0, 10), 'C1', 'T3')]
+    events = score(card_owners, transactions, previous_day_transactions=previous_day_transactions)
+    # операция предыдущего дня входит в окно, но в отчет за дату попадает только операция этой даты
+    assert event_types(events) == [(at(0, 10), TWO_OR_MORE_CITIES_EVENT_TYPE)]
+    assert events == reference_events(card_owners, previous_day_transactions + transactions)
+
+
+def test_matches_report_rules_on_random_transactions():
+    rnd = random.Random(0)
+    passport_valid_to = {str(x): rnd.choice([None, VALID_TO, REPORT_DATE - datetime.timedelta(days=1)])
+                         for x in range(15)}
+    card_owners = {
+        f'C{i}': owner(str(i % 15), passport_valid_to=passport_valid_to[str(i % 15)],
+                       account_valid_to=rnd.choice([VALID_TO, REPORT_DATE, REPORT_DATE - datetime.timedelta(days=1)]))
+        for i in range(30)
+    }
+    start = at(0) - datetime.timedelta(hours=1)
+    transaction_dates = sorted(start + datetime.timedelta(minutes=rnd.randrange(25 * 60)) for _ in range(600))
+    transactions = [(str(i), x, rnd.choice(list(card_owners) + ['C99']), rnd.choice(list(TERMINAL_CITIES) + ['T9']))
+                    for i, x in enumerate(transaction_dates)]
+    previous_day_transactions = [x for x in transactions if x[1].date() < REPORT_DATE]
+    report_day_transactions = [x for x in transactions if x[1].date() == REPORT_DATE]
+    blacklisted_passports = frozenset({'P3', 'P7'})
+
+    for batch_size in [1, 7, 100, None]:
+        events = score(card_owners, report_day_transactions, batch_size, blacklisted_passports,
+                       previous_day_transactions)
+        assert events == reference_events(card_owners, transactions, blacklisted_passports)